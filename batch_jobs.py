@@ -0,0 +1,274 @@
+"""Bulk scoring through the OpenAI Batch API.
+
+Unscored headlines are exported to JSONL request files, which are uploaded and
+submitted as batch jobs, polled, and ingested back into `headlines.output` with
+bulk UPDATEs. Progress is recorded per file in the `batch_jobs` table, so an
+interrupted run picks up where it stopped: exported files are not rewritten,
+uploaded files are not uploaded again, and submitted jobs are only polled.
+
+Job states: exported -> uploaded -> submitted -> done -> ingested. A file
+the Batches API rejects for any reason but a rate or enqueued-token limit is
+marked failed with the error; its rows are exported again once that job row is
+deleted.
+"""
+import json
+import os
+import sqlite3
+import time
+from datetime import datetime
+from pathlib import Path
+
+API_BASE = "https://api.openai.com/v1"
+BATCH_DIR = "batch_jobs"
+BATCH_FILE_ROWS = 50000  # The Batch API accepts at most 50,000 requests per file
+BATCH_MAX_ACTIVE = 5  # Jobs submitted and not yet finished at any time
+BATCH_POLL_SECONDS = 60
+COMPLETIONS_URL = "/v1/chat/completions"
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class BatchClient:
+    """The few Files and Batches API calls the pipeline needs."""
+
+    def __init__(self, api_key, api_base=API_BASE, timeout=300):
+        self.api_base = api_base.rstrip("/")
+        self.timeout = timeout
+        import requests  # Only --bulk talks to the Files and Batches APIs
+
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = f"Bearer {api_key}"
+
+    def request(self, method, path, **kwargs):
+        response = self.session.request(
+            method, self.api_base + path, timeout=self.timeout, **kwargs
+        )
+        response.raise_for_status()
+        return response
+
+    def upload_file(self, path):
+        with open(path, "rb") as f:
+            response = self.request(
+                "POST",
+                "/files",
+                data={"purpose": "batch"},
+                files={"file": (Path(path).name, f, "application/jsonl")},
+            )
+        return response.json()["id"]
+
+    def create_batch(self, input_file_id):
+        response = self.request(
+            "POST",
+            "/batches",
+            json={
+                "input_file_id": input_file_id,
+                "endpoint": COMPLETIONS_URL,
+                "completion_window": "24h",
+            },
+        )
+        return response.json()["id"]
+
+    def get_batch(self, batch_id):
+        return self.request("GET", f"/batches/{batch_id}").json()
+
+    def file_content(self, file_id):
+        return self.request("GET", f"/files/{file_id}/content").text
+
+
+def create_jobs_table(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS batch_jobs (
+            path TEXT PRIMARY KEY,
+            first_id INTEGER,
+            last_id INTEGER,
+            rows INTEGER,
+            status TEXT,
+            file_id TEXT,
+            batch_id TEXT,
+            output_file_id TEXT,
+            scored INTEGER,
+            error TEXT,
+            updated_at TEXT
+        )
+    """
+    )
+    if "error" not in {column for _, column, *_ in conn.execute("PRAGMA table_info(batch_jobs)")}:
+        conn.execute("ALTER TABLE batch_jobs ADD COLUMN error TEXT")
+
+
+def set_job(conn, path, **fields):
+    fields["updated_at"] = datetime.now().isoformat(timespec="seconds")
+    assignments = ", ".join(f"{name} = ?" for name in fields)
+    with conn:
+        conn.execute(
+            f"UPDATE batch_jobs SET {assignments} WHERE path = ?",
+            (*fields.values(), str(path)),
+        )
+
+
+def pending_rows(conn):
+    """Unscored rows not already covered by a job still in flight, in id order."""
+    return conn.execute(
+        """
+        SELECT id, strftime('%Y', ydm), strftime('%m', ydm), headline FROM headlines
+        WHERE output IS NULL AND NOT EXISTS (
+            SELECT 1 FROM batch_jobs j
+            WHERE j.status != 'ingested' AND headlines.id BETWEEN j.first_id AND j.last_id
+        )
+        ORDER BY id
+    """
+    )
+
+
+def write_request_file(path, rows, build_messages, model):
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for id, year, month, headline in rows:
+            request = {
+                "custom_id": f"headline-{id}",
+                "method": "POST",
+                "url": COMPLETIONS_URL,
+                "body": {"model": model, "messages": build_messages(year, month, headline)},
+            }
+            f.write(json.dumps(request) + "\n")
+    os.replace(tmp_path, path)
+
+
+def export_pending(conn, build_messages, model, batch_dir=BATCH_DIR, rows_per_file=BATCH_FILE_ROWS):
+    """Write unscored rows to request files of at most `rows_per_file`; returns the files written."""
+    batch_dir = Path(batch_dir)
+    batch_dir.mkdir(parents=True, exist_ok=True)
+    cursor = pending_rows(conn)
+    written = []
+    while True:
+        rows = cursor.fetchmany(rows_per_file)
+        if not rows:
+            break
+        path = batch_dir / f"headlines_{rows[0][0]}_{rows[-1][0]}.jsonl"
+        write_request_file(path, rows, build_messages, model)
+        with conn:
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO batch_jobs (path, first_id, last_id, rows, status, updated_at)
+                VALUES (?, ?, ?, ?, 'exported', ?)
+            """,
+                (str(path), rows[0][0], rows[-1][0], len(rows), datetime.now().isoformat(timespec="seconds")),
+            )
+        written.append(path)
+    return written
+
+
+def is_retryable(response):
+    """Whether a rejected create_batch call is worth repeating later."""
+    return response.status_code in RETRY_STATUSES or "token_limit" in response.text
+
+
+def submit_jobs(conn, client, max_active=BATCH_MAX_ACTIVE):
+    import requests
+
+    active = conn.execute(
+        "SELECT COUNT(*) FROM batch_jobs WHERE status = 'submitted'"
+    ).fetchone()[0]
+    jobs = conn.execute(
+        "SELECT path, status, file_id FROM batch_jobs WHERE status IN ('exported', 'uploaded') ORDER BY first_id"
+    ).fetchall()
+    for path, status, file_id in jobs:
+        if active >= max_active:
+            break
+        if status == "exported":
+            file_id = client.upload_file(path)
+            set_job(conn, path, status="uploaded", file_id=file_id)
+        try:
+            batch_id = client.create_batch(file_id)
+        except requests.HTTPError as e:
+            if is_retryable(e.response):
+                # The enqueued-token limit; the file stays uploaded for the next round
+                print(f"Warning: could not submit {path} yet: {e}")
+                break
+            print(f"Error: {path} was rejected: {e}")
+            set_job(conn, path, status="failed", error=f"{e}: {e.response.text}")
+            continue
+        set_job(conn, path, status="submitted", batch_id=batch_id)
+        active += 1
+
+
+def poll_jobs(conn, client):
+    jobs = conn.execute(
+        "SELECT path, batch_id FROM batch_jobs WHERE status = 'submitted'"
+    ).fetchall()
+    for path, batch_id in jobs:
+        batch = client.get_batch(batch_id)
+        if batch["status"] in TERMINAL_STATUSES:
+            # Expired and cancelled jobs still return the requests that finished
+            set_job(conn, path, status="done", output_file_id=batch.get("output_file_id"))
+
+
+def parse_result_line(line):
+    """Return (id, score) for a valid result line, or None."""
+    result = json.loads(line)
+    response = result.get("response") or {}
+    if response.get("status_code") != 200:
+        return None
+    try:
+        content = response["body"]["choices"][0]["message"]["content"]
+        number = int(content)
+    except (KeyError, IndexError, TypeError, ValueError):
+        return None
+    if not 1 <= number <= 100:
+        return None
+    return int(result["custom_id"].removeprefix("headline-")), number
+
+
+def ingest_jobs(conn, client):
+    """Write results of finished jobs back with one UPDATE batch per file; returns rows scored."""
+    scored = 0
+    jobs = conn.execute(
+        "SELECT path, output_file_id FROM batch_jobs WHERE status = 'done'"
+    ).fetchall()
+    for path, output_file_id in jobs:
+        updates = []
+        if output_file_id:
+            for line in client.file_content(output_file_id).splitlines():
+                if line.strip():
+                    parsed = parse_result_line(line)
+                    if parsed is not None:
+                        updates.append((parsed[1], parsed[0]))
+        with conn:
+            conn.executemany(
+                "UPDATE headlines SET output = ? WHERE id = ? AND output IS NULL", updates
+            )
+            conn.execute(
+                "UPDATE batch_jobs SET status = 'ingested', scored = ?, updated_at = ? WHERE path = ?",
+                (len(updates), datetime.now().isoformat(timespec="seconds"), path),
+            )
+        scored += len(updates)
+    return scored
+
+
+def run_bulk(
+    db,
+    client,
+    build_messages,
+    model,
+    batch_dir=BATCH_DIR,
+    rows_per_file=BATCH_FILE_ROWS,
+    max_active=BATCH_MAX_ACTIVE,
+    poll_seconds=BATCH_POLL_SECONDS,
+):
+    """Export, submit, poll and ingest until no job is left in flight."""
+    with sqlite3.connect(db) as conn:
+        create_jobs_table(conn)
+        exported = export_pending(conn, build_messages, model, batch_dir, rows_per_file)
+        print(f"Exported {len(exported)} request files")
+        while True:
+            submit_jobs(conn, client, max_active)
+            poll_jobs(conn, client)
+            scored = ingest_jobs(conn, client)
+            counts = dict(
+                conn.execute("SELECT status, COUNT(*) FROM batch_jobs GROUP BY status").fetchall()
+            )
+            print(f"Batch jobs: {counts} - scored this round: {scored}")
+            if not any(counts.get(status) for status in ("exported", "uploaded", "submitted", "done")):
+                break
+            time.sleep(poll_seconds)
@@ -0,0 +1,88 @@
+"""Compare daily score aggregation in Python against the SQL GROUP BY.
+
+    python -m benchmarks.aggregation --rows 2000000
+
+Builds a synthetic database (see benchmarks.synthetic_db) unless --db points
+at an existing one, then times the original LIMIT/OFFSET loop, the keyset
+Python loop and aggregate_daily_scores(), checking all three agree. The
+first SQL call, which builds the covering index, is timed separately.
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+
+import correlation_analysis
+from benchmarks.synthetic_db import make_db
+
+
+def offset_aggregate(db, batch_size=correlation_analysis.BATCH_SIZE):
+    """The original LIMIT/OFFSET batching, kept here as the baseline."""
+    daily_scores = {}
+    with sqlite3.connect(db) as conn:
+        offset = 0
+        while True:
+            data = conn.execute(
+                "SELECT ydm, output FROM headlines LIMIT ? OFFSET ?", (batch_size, offset)
+            ).fetchall()
+            if not data:
+                break
+            for date, output in data:
+                try:
+                    score = int(output) - 50
+                except (TypeError, ValueError):
+                    continue
+                daily_scores[date] = daily_scores.get(date, 0) + score
+            offset += batch_size
+    return daily_scores
+
+
+def keyset_aggregate(db):
+    correlation_analysis.DB_PATH = db
+    return correlation_analysis.adjust_and_aggregate_scores()
+
+
+def sql_aggregate(db):
+    scores_df = correlation_analysis.aggregate_daily_scores(db)
+    return {date.isoformat(): score for date, score in zip(scores_df['Date'], scores_df['Score'])}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", help="existing headlines database (default: synthetic)")
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--skip-offset", action="store_true", help="skip the quadratic baseline")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = args.db
+        if db is None:
+            db = os.path.join(tmp, "headlines.db")
+            start = time.perf_counter()
+            make_db(db, args.rows)
+            print(f"generated {args.rows} rows in {time.perf_counter() - start:.1f}s")
+
+        start = time.perf_counter()
+        sql_aggregate(db)
+        print(f"first sql run (builds idx_headlines_ydm_output): {time.perf_counter() - start:.2f}s")
+
+        runs = [("keyset", keyset_aggregate), ("sql", sql_aggregate)]
+        if not args.skip_offset:
+            runs.insert(0, ("offset", offset_aggregate))
+        results = {}
+        for name, aggregate in runs:
+            start = time.perf_counter()
+            results[name] = aggregate(db)
+            results[name + "_seconds"] = time.perf_counter() - start
+            print(f"{name:>6}: {results[name + '_seconds']:.2f}s  {len(results[name])} days")
+
+        reference = results["sql"]
+        for name, _ in runs:
+            assert results[name] == reference, f"{name} disagrees with sql"
+        for name, _ in runs[:-1]:
+            print(f"sql is {results[name + '_seconds'] / results['sql_seconds']:.1f}x faster than {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Compare the headline extractors on saved archive pages.
+
+    python -m benchmarks.extractors path/to/pages --repeat 5
+
+Every *.html file under the directory is parsed by each extractor. The run
+fails if any extractor disagrees with the BeautifulSoup reference on any page,
+then reports pages/sec per extractor. `--cache-dir` reads the pages from the
+crawler's raw page cache instead. Without either, synthetic pages from the
+archive stub are used.
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+from benchmarks.servers import archive_day, render_archive_page
+from extractors import EXTRACTORS
+from page_cache import PageCache
+
+REFERENCE = "bs4"
+
+
+def load_pages(pages_dir=None, synthetic=200):
+    if pages_dir is None:
+        pages = []
+        for day in range(synthetic):
+            for headlines in archive_day(2020, 1 + day % 12, 1 + day % 28, per_page=50):
+                pages.append(render_archive_page(headlines))
+        return pages
+    paths = sorted(Path(pages_dir).rglob("*.htm*"))
+    return [path.read_text(encoding="utf-8", errors="replace") for path in paths]
+
+
+def check_agreement(pages):
+    mismatches = []
+    for index, page in enumerate(pages):
+        expected = EXTRACTORS[REFERENCE](page)
+        for name, extract in EXTRACTORS.items():
+            if name != REFERENCE and extract(page) != expected:
+                mismatches.append((index, name))
+    return mismatches
+
+
+def pages_per_second(extract, pages, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for page in pages:
+            extract(page)
+    return len(pages) * repeat / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("pages_dir", nargs="?", help="Directory of saved archive pages")
+    parser.add_argument("--cache-dir", help="Read pages from a crawler page cache")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.cache_dir:
+        cache = PageCache(args.cache_dir)
+        pages = list(cache.iter_texts())
+        cache.close()
+    else:
+        pages = load_pages(args.pages_dir)
+    if not pages:
+        sys.exit(f"No pages found under {args.cache_dir or args.pages_dir}")
+    mismatches = check_agreement(pages)
+    if mismatches:
+        for index, name in mismatches:
+            print(f"Mismatch: extractor '{name}' differs from '{REFERENCE}' on page {index}")
+        sys.exit(1)
+    headlines = sum(len(EXTRACTORS[REFERENCE](page)) for page in pages)
+    print(f"{len(pages)} pages, {headlines} headlines, all extractors agree")
+    baseline = pages_per_second(EXTRACTORS[REFERENCE], pages, args.repeat)
+    for name, extract in sorted(EXTRACTORS.items()):
+        rate = baseline if name == REFERENCE else pages_per_second(extract, pages, args.repeat)
+        print(f"{name:>8}: {rate:10.1f} pages/sec ({rate / baseline:5.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+"""Offline end-to-end benchmark of the scrape, score and analysis stages.
+
+    python -m benchmarks.pipeline --days 30 --score-rows 2000 --output bench.json
+
+Starts the archive and completions stubs from benchmarks.servers in this
+process, then runs each script as a subprocess in a scratch directory:
+
+- scrape: headlines.py over `--days` days of the stub archive
+- score: chatgpt.py over a synthetic database of `--score-rows` unscored rows
+- analysis: correlation_analysis.py over `--analysis-rows` scored rows and a
+  synthetic index CSV
+
+For each stage, the wall time, rows/sec, requests/sec and the subprocess's
+peak RSS are written to `--output` as JSON, along with the stage's own
+--metrics export and the git commit. Peak RSS comes from os.wait4 and is
+null on Windows, which lacks it. Two result files can then be compared
+to spot regressions. Stub latency, error and invalid-answer rates, and the
+server's rate limits are configurable, so retry and back-off paths can be
+exercised too. The exit status is non-zero when any stage failed.
+
+The scorer counts tokens with tiktoken, which downloads its encoding on
+first use. The encoding is loaded into `--tiktoken-cache` (TIKTOKEN_CACHE_DIR,
+by default ~/.cache/tiktoken) before any stage runs, so after one run with
+network access the benchmark never leaves the machine.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+from benchmarks.servers import ArchiveStubHandler, CompletionsStubHandler, configure, start_server
+from benchmarks.synthetic_db import make_db, make_index_csv
+
+ROOT = Path(__file__).resolve().parent.parent
+STAGES = ("scrape", "score", "analysis")
+TIKTOKEN_CACHE_DIR = os.environ.get("TIKTOKEN_CACHE_DIR", str(Path.home() / ".cache" / "tiktoken"))
+
+
+def run_stage(name, argv, cwd, env=None):
+    """Run one script to completion; returns seconds, peak RSS and its exit code."""
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, *argv], cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+    )
+    stderr = process.stderr.read()
+    peak_rss_mb = None
+    if hasattr(os, "wait4"):
+        # wait4 reports this child's own rusage, unlike RUSAGE_CHILDREN's running maximum
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        peak_kb = usage.ru_maxrss if sys.platform != "darwin" else usage.ru_maxrss / 1024
+        peak_rss_mb = peak_kb / 1024
+    else:
+        process.wait()  # Windows: no rusage for a child, so no peak RSS
+    seconds = time.perf_counter() - start
+    if process.returncode:
+        print(f"{name} failed ({process.returncode}):\n{stderr.decode(errors='replace')[-2000:]}", file=sys.stderr)
+    return {"seconds": seconds, "peak_rss_mb": peak_rss_mb, "exit_code": process.returncode}
+
+
+def seed_tiktoken_cache(cache_dir):
+    """Load the scorer's encoding through `cache_dir`, downloading it only if missing; returns an error or None."""
+    os.environ["TIKTOKEN_CACHE_DIR"] = cache_dir
+    from chatgpt import GPT_MODEL
+    from cost_estimate import get_encoding
+
+    try:
+        get_encoding(GPT_MODEL)
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
+    return None
+
+
+def read_metrics(path):
+    try:
+        with open(path) as f:
+            return json.load(f)["metrics"]
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def metric_value(metrics, key, field="value"):
+    return metrics.get(key, {}).get(field, 0)
+
+
+def summarise_metrics(metrics):
+    """Counters as values; histograms as count, sum and p50/p90/p99."""
+    summary = {}
+    for key, entry in metrics.items():
+        if entry["type"] == "counter":
+            summary[key] = entry["value"]
+        else:
+            summary[key] = {field: entry[field] for field in ("count", "sum", "p50", "p90", "p99")}
+    return summary
+
+
+def stage_result(run, rows, requests, metrics):
+    seconds = run["seconds"]
+    return {
+        **run,
+        "rows": rows,
+        "rows_per_sec": rows / seconds if seconds else 0.0,
+        "requests": requests,
+        "requests_per_sec": requests / seconds if seconds else 0.0,
+        "metrics": summarise_metrics(metrics),
+    }
+
+
+def bench_scrape(args, work, archive_url):
+    stage_dir = work / "scrape"
+    stage_dir.mkdir()
+    end = args.start + timedelta(days=args.days - 1)
+    run = run_stage(
+        "scrape",
+        [
+            str(ROOT / "headlines.py"),
+            "--start", args.start.isoformat(),
+            "--end", end.isoformat(),
+            "--base-url", archive_url,
+            "--no-cache",
+            "--delay", "0",
+            "--workers", str(args.scrape_workers),
+            "--metrics", "metrics.json",
+        ],
+        stage_dir,
+    )
+    metrics = read_metrics(stage_dir / "metrics.json")
+    rows = metric_value(metrics, "scrape_rows_written_total")
+    requests = metric_value(metrics, 'scrape_pages_total{source="network"}')
+    return stage_result(run, rows, requests, metrics)
+
+
+def bench_score(args, work, completions_url):
+    stage_dir = work / "score"
+    stage_dir.mkdir()
+    make_db(stage_dir / "headlines.db", args.score_rows, days=max(1, args.score_rows // 40), unscored=1.0, invalid=0.0)
+    env = {
+        **os.environ,
+        "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "benchmark"),
+        "TIKTOKEN_CACHE_DIR": args.tiktoken_cache,
+    }
+    run = run_stage(
+        "score",
+        [
+            str(ROOT / "chatgpt.py"),
+            "--endpoint", completions_url,
+            "--workers", str(args.score_workers),
+            "--batch-size", str(args.batch_size),
+            "--no-response-cache",
+            "--requests-per-minute", str(args.requests_per_minute),
+            "--tokens-per-minute", str(args.tokens_per_minute),
+            "--metrics", "metrics.json",
+        ],
+        stage_dir,
+        env,
+    )
+    metrics = read_metrics(stage_dir / "metrics.json")
+    rows = metric_value(metrics, "score_rows_written_total")
+    requests = metric_value(metrics, "score_completion_seconds", "count")
+    return stage_result(run, rows, requests, metrics)
+
+
+def bench_analysis(args, work):
+    stage_dir = work / "analysis"
+    stage_dir.mkdir()
+    days = max(1, args.analysis_rows // 200)
+    make_db(stage_dir / "headlines.db", args.analysis_rows, days=days, start=args.start, unscored=0.0)
+    make_index_csv(stage_dir / "VIX.csv", days=days, start=args.start)
+    run = run_stage(
+        "analysis",
+        [
+            str(ROOT / "correlation_analysis.py"),
+            "--replicates", str(args.replicates),
+            "--no-cache",
+            "--metrics", "metrics.json",
+        ],
+        stage_dir,
+    )
+    metrics = read_metrics(stage_dir / "metrics.json")
+    return stage_result(run, args.analysis_rows, 0, metrics)
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--work-dir", help="keep stage directories here instead of a temporary one")
+    parser.add_argument("--start", type=date.fromisoformat, default=date(2020, 1, 1))
+    parser.add_argument("--days", type=int, default=30, help="archive days scraped")
+    parser.add_argument("--scrape-workers", type=int, default=8)
+    parser.add_argument("--archive-latency", type=float, default=0.02, help="stub seconds per archive page")
+    parser.add_argument("--score-rows", type=int, default=2000)
+    parser.add_argument("--score-workers", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--completion-latency", type=float, default=0.05, help="stub seconds per completion")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of completions answered with a 500")
+    parser.add_argument("--invalid-rate", type=float, default=0.0, help="share of completions that aren't a score")
+    parser.add_argument("--limit-requests", type=int, default=100000, help="stub requests per minute")
+    parser.add_argument("--limit-tokens", type=int, default=10**8, help="stub tokens per minute")
+    parser.add_argument("--requests-per-minute", type=int, default=100000, help="scorer's client-side limit")
+    parser.add_argument("--tokens-per-minute", type=int, default=10**8, help="scorer's client-side limit")
+    parser.add_argument("--analysis-rows", type=int, default=1000000)
+    parser.add_argument("--replicates", type=int, default=20000)
+    parser.add_argument(
+        "--tiktoken-cache",
+        default=TIKTOKEN_CACHE_DIR,
+        help="tiktoken encoding cache used by the score stage; filled once with network access",
+    )
+    args = parser.parse_args()
+
+    if "score" in args.stages:
+        error = seed_tiktoken_cache(args.tiktoken_cache)
+        if error is not None:
+            sys.exit(
+                f"The score stage needs the tiktoken encoding, which isn't in {args.tiktoken_cache} ({error}). "
+                "Run once with network access to fill it, or point --tiktoken-cache at a copy."
+            )
+
+    archive, archive_url = start_server(configure(ArchiveStubHandler, latency=args.archive_latency))
+    completions, completions_url = start_server(
+        configure(
+            CompletionsStubHandler,
+            latency=args.completion_latency,
+            error_rate=args.error_rate,
+            invalid_rate=args.invalid_rate,
+            limit_requests=args.limit_requests,
+            limit_tokens=args.limit_tokens,
+        )
+    )
+    results = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "started_at": time.time(),
+        "config": {key: str(value) if isinstance(value, date) else value for key, value in vars(args).items()},
+        "stages": {},
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        work = Path(args.work_dir or tmp)
+        work.mkdir(parents=True, exist_ok=True)
+        runners = {
+            "scrape": lambda: bench_scrape(args, work, archive_url),
+            "score": lambda: bench_score(args, work, completions_url + "/v1/chat/completions"),
+            "analysis": lambda: bench_analysis(args, work),
+        }
+        for stage in args.stages:
+            result = results["stages"][stage] = runners[stage]()
+            print(
+                f"{stage:>8}: {result['seconds']:7.2f}s  {result['rows_per_sec']:10.0f} rows/sec  "
+                f"{result['requests_per_sec']:8.1f} req/sec"
+                + (f"  peak {result['peak_rss_mb']:7.1f} MB" if result["peak_rss_mb"] is not None else "")
+                + (f"  exit {result['exit_code']}" if result["exit_code"] else "")
+            )
+    archive.shutdown()
+    completions.shutdown()
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"results written to {args.output}")
+    failed = [stage for stage, result in results["stages"].items() if result["exit_code"]]
+    if failed:
+        sys.exit(f"failed stages: {', '.join(failed)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,364 @@
+"""Local stand-ins for the remote services the pipeline talks to.
+
+Run a stub on its own with:
+
+    python -m benchmarks.servers archive --port 8000
+    python -m benchmarks.servers completions --port 8001
+    python -m benchmarks.servers batch --port 8002
+
+and point the scripts at them with `python headlines.py --base-url
+http://127.0.0.1:8000`, `python chatgpt.py --endpoint http://127.0.0.1:8001` and
+`python chatgpt.py --bulk --api-base http://127.0.0.1:8002/v1`.
+
+`--latency` delays every response, and `--error-rate` / `--invalid-rate` make
+the completions stub answer that share of requests with a 500 or with text
+that is not a score. Both are seeded, so runs are repeatable.
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from email.policy import default as email_policy
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+WORDS = (
+    "Fed stocks oil bonds earnings rally slump dollar yields inflation "
+    "markets banks tech merger jobs housing China Europe rates profit"
+).split()
+PAGE_TEMPLATE = """<!DOCTYPE html>
+<html><head><title>News Archive</title></head>
+<body><main><ol class="WSJTheme--list">
+{items}
+</ol></main></body></html>"""
+ITEM_TEMPLATE = """<li><article class="WSJTheme--story--XB4V2mLz">
+<div class="WSJTheme--headline--7VCzo7Ay"><h2 class="WSJTheme--headline--unZqjb45"><a href="https://www.wsj.com/articles/{slug}"><span class="WSJTheme--headlineText--He1ANr9C ">{headline}</span></a></h2></div>
+<p class="WSJTheme--summary--lmOXEsbN"><span class="WSJTheme--summaryText--2LRaCWgJ">{summary}</span></p>
+</article></li>"""
+ARCHIVE_PATH = re.compile(r"^/(\d{4})/(\d{1,2})/(\d{1,2})$")
+BATCH_COUNT = re.compile(r"JSON array of exactly (\d+) integers")
+BATCH_ITEM = re.compile(r"^\d+\. (.*)$", re.MULTILINE)
+
+
+def archive_day(year, month, day, max_pages=3, per_page=20):
+    """Deterministic headlines for one archive day, split into pages."""
+    rng = random.Random(f"{year}-{month}-{day}")
+    pages = []
+    for _ in range(rng.randint(1, max_pages)):
+        pages.append(
+            [
+                " ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 10)))
+                for _ in range(rng.randint(1, per_page))
+            ]
+        )
+    return pages
+
+
+def stub_score(headline):
+    """The score the completions stub gives a headline, alone or in a batch."""
+    return 1 + hashlib.sha256(headline.encode("utf-8")).digest()[0] % 100
+
+
+def render_archive_page(headlines):
+    items = "\n".join(
+        ITEM_TEMPLATE.format(
+            slug=headline.lower().replace(" ", "-"),
+            headline=headline,
+            summary=f"Summary for {headline}.",
+        )
+        for headline in headlines
+    )
+    return PAGE_TEMPLATE.format(items=items)
+
+
+class ArchiveStubHandler(BaseHTTPRequestHandler):
+    """Serves /<year>/<month>/<day>?page=<n> like the WSJ archive, 404 past the last page."""
+
+    protocol_version = "HTTP/1.1"  # keep-alive, so pooled connections are reused
+    max_pages = 3
+    per_page = 20
+    latency = 0.0
+
+    def do_GET(self):
+        if self.latency:
+            time.sleep(self.latency)
+        parts = urlsplit(self.path)
+        match = ARCHIVE_PATH.match(parts.path)
+        page = int(parse_qs(parts.query).get("page", ["1"])[0])
+        if match is None:
+            return self.send_body(404, b"not found")
+        year, month, day = (int(group) for group in match.groups())
+        pages = archive_day(year, month, day, self.max_pages, self.per_page)
+        if not 1 <= page <= len(pages):
+            return self.send_body(404, b"not found")
+        self.send_body(200, render_archive_page(pages[page - 1]).encode("utf-8"))
+
+    def send_body(self, status, body, content_type="text/html; charset=utf-8"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def stub_completion(model, prompt, prompt_tokens):
+    """A chat completion scoring the headline(s) in `prompt`."""
+    batch = BATCH_COUNT.search(prompt)
+    if batch:
+        headlines = BATCH_ITEM.findall(prompt)[: int(batch.group(1))]
+        content = json.dumps([stub_score(headline) for headline in headlines])
+    else:
+        content = str(stub_score(prompt.rsplit("headline: ", 1)[-1]))
+    return {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion",
+        "model": model,
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }
+        ],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": 1,
+            "total_tokens": prompt_tokens + 1,
+        },
+    }
+
+
+class JSONHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class CompletionsStubHandler(JSONHandler):
+    """Answers POSTs like the chat completions endpoint with a deterministic 1-100 score.
+
+    Requests and tokens are counted in one-minute windows and reported through
+    `x-ratelimit-*` headers; going over either limit returns a 429 with the
+    same error message the real API uses. `error_rate` and `invalid_rate`
+    inject 500s and non-numeric answers into that share of requests.
+    """
+
+    limit_requests = 500
+    limit_tokens = 200000
+    latency = 0.0
+    error_rate = 0.0
+    invalid_rate = 0.0
+    seed = 0
+    lock = threading.Lock()
+    window_start = 0.0
+    used_requests = 0
+    used_tokens = 0
+    rng = None
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        if self.latency:
+            time.sleep(self.latency)
+        prompt = "".join(message["content"] for message in body.get("messages", []))
+        prompt_tokens = len(prompt.split())
+        cls = type(self)
+        with cls.lock:
+            now = time.monotonic()
+            if now - cls.window_start >= 60:
+                cls.window_start, cls.used_requests, cls.used_tokens = now, 0, 0
+            reset = 60 - (now - cls.window_start)
+            limited = (
+                cls.used_requests >= cls.limit_requests
+                or cls.used_tokens + prompt_tokens > cls.limit_tokens
+            )
+            if not limited:
+                cls.used_requests += 1
+                cls.used_tokens += prompt_tokens + 1
+            if cls.rng is None:
+                cls.rng = random.Random(cls.seed)
+            roll = cls.rng.random()
+            headers = {
+                "x-ratelimit-limit-requests": str(cls.limit_requests),
+                "x-ratelimit-limit-tokens": str(cls.limit_tokens),
+                "x-ratelimit-remaining-requests": str(cls.limit_requests - cls.used_requests),
+                "x-ratelimit-remaining-tokens": str(cls.limit_tokens - cls.used_tokens),
+                "x-ratelimit-reset-requests": f"{reset:.3f}s",
+                "x-ratelimit-reset-tokens": f"{reset:.3f}s",
+            }
+        if limited:
+            error = {
+                "error": {
+                    "message": f"Rate limit reached for requests. Please try again in {reset:.3f}s. Visit https://platform.openai.com/account/rate-limits to learn more.",
+                    "type": "requests",
+                }
+            }
+            return self.send_json(429, error, headers)
+        if roll < self.error_rate:
+            error = {"error": {"message": "The server had an error while processing your request.", "type": "server_error"}}
+            return self.send_json(500, error, headers)
+        completion = stub_completion(body.get("model", ""), prompt, prompt_tokens)
+        if roll < self.error_rate + self.invalid_rate:
+            completion["choices"][0]["message"]["content"] = "I cannot predict market movements."
+        self.send_json(200, completion, headers)
+
+
+class BatchStubHandler(JSONHandler):
+    """A minimal Files and Batches API backed by memory.
+
+    Uploaded request files are answered with the completions stub's scores.
+    A batch reports `in_progress` for its first `polls_before_done` status
+    checks and `completed` afterwards; `fail_every` makes every n-th request
+    in a file come back as an error line.
+    """
+
+    polls_before_done = 1
+    fail_every = 0
+    lock = threading.Lock()
+    files = {}
+    batches = {}
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        cls = type(self)
+        with cls.lock:
+            if self.path == "/v1/files":
+                content = self.multipart_file(body)
+                file_id = f"file-{len(cls.files) + 1}"
+                cls.files[file_id] = content
+                return self.send_json(200, {"id": file_id, "object": "file", "purpose": "batch"})
+            if self.path == "/v1/batches":
+                request = json.loads(body)
+                if request.get("input_file_id") not in cls.files:
+                    return self.send_json(400, {"error": {"message": "Unknown input file"}})
+                batch_id = f"batch_{len(cls.batches) + 1}"
+                cls.batches[batch_id] = {
+                    "id": batch_id,
+                    "status": "validating",
+                    "input_file_id": request["input_file_id"],
+                    "output_file_id": None,
+                    "polls": 0,
+                }
+                return self.send_json(200, self.public(cls.batches[batch_id]))
+        self.send_json(404, {"error": {"message": "not found"}})
+
+    def do_GET(self):
+        cls = type(self)
+        with cls.lock:
+            match = re.match(r"^/v1/batches/([\w-]+)$", self.path)
+            if match and match.group(1) in cls.batches:
+                batch = cls.batches[match.group(1)]
+                batch["polls"] += 1
+                if batch["polls"] > cls.polls_before_done and batch["status"] != "completed":
+                    output_id = f"file-{len(cls.files) + 1}"
+                    cls.files[output_id] = self.run_batch(cls.files[batch["input_file_id"]])
+                    batch.update(status="completed", output_file_id=output_id)
+                elif batch["status"] == "validating":
+                    batch["status"] = "in_progress"
+                return self.send_json(200, self.public(batch))
+            match = re.match(r"^/v1/files/([\w-]+)/content$", self.path)
+            if match and match.group(1) in cls.files:
+                body = cls.files[match.group(1)]
+                self.send_response(200)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                return self.wfile.write(body)
+        self.send_json(404, {"error": {"message": "not found"}})
+
+    def multipart_file(self, body):
+        header = f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode()
+        message = BytesParser(policy=email_policy).parsebytes(header + body)
+        for part in message.iter_parts():
+            if part.get_param("name", header="content-disposition") == "file":
+                return part.get_payload(decode=True)
+        return b""
+
+    def run_batch(self, content):
+        lines = []
+        for number, line in enumerate(content.decode("utf-8").splitlines(), 1):
+            request = json.loads(line)
+            result = {"id": f"batch_req_{number}", "custom_id": request["custom_id"]}
+            if self.fail_every and number % self.fail_every == 0:
+                result.update(response=None, error={"code": "server_error", "message": "stub failure"})
+            else:
+                messages = request["body"]["messages"]
+                prompt = "".join(message["content"] for message in messages)
+                completion = stub_completion(request["body"].get("model", ""), prompt, len(prompt.split()))
+                result.update(response={"status_code": 200, "body": completion}, error=None)
+            lines.append(json.dumps(result))
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+    @staticmethod
+    def public(batch):
+        return {key: value for key, value in batch.items() if key != "polls"}
+
+
+def configure(handler, **options):
+    """A subclass of `handler` with the given class attributes (latency, limits, ...) and fresh state."""
+    return type(handler.__name__, (handler,), {"lock": threading.Lock(), **options})
+
+
+def start_server(handler, host="127.0.0.1", port=0):
+    """Start `handler` on a background thread; returns (server, base_url)."""
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+HANDLERS = {
+    "archive": ArchiveStubHandler,
+    "completions": CompletionsStubHandler,
+    "batch": BatchStubHandler,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("service", choices=sorted(HANDLERS), nargs="?", default="archive")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of completions answered with a 500")
+    parser.add_argument("--invalid-rate", type=float, default=0.0, help="share of completions that aren't a score")
+    parser.add_argument("--limit-requests", type=int, default=CompletionsStubHandler.limit_requests)
+    parser.add_argument("--limit-tokens", type=int, default=CompletionsStubHandler.limit_tokens)
+    args = parser.parse_args()
+    handler = HANDLERS[args.service]
+    if args.service == "archive":
+        handler = configure(handler, latency=args.latency)
+    elif args.service == "completions":
+        handler = configure(
+            handler,
+            latency=args.latency,
+            error_rate=args.error_rate,
+            invalid_rate=args.invalid_rate,
+            limit_requests=args.limit_requests,
+            limit_tokens=args.limit_tokens,
+        )
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    print(f"{args.service} stub listening on http://{args.host}:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Generate synthetic headlines databases and index CSVs for benchmarks.
+
+    python -m benchmarks.synthetic_db bench.db --rows 2000000
+
+Rows spread evenly over consecutive days from `start`, with scores between 1
+and 100. A share of rows is left unscored and a few carry invalid outputs, as
+in a real partially scored database. make_index_csv() writes a random-walk
+price series in the layout of a Yahoo Finance export, like VIX.csv.
+"""
+import argparse
+import random
+import sqlite3
+from datetime import date, timedelta
+
+from benchmarks.servers import WORDS
+
+
+def make_db(
+    path,
+    rows,
+    days=9500,
+    start=date(1998, 1, 1),
+    unscored=0.05,
+    invalid=0.001,
+    seed=0,
+    chunk_rows=100000,
+):
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS headlines (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            headline TEXT,
+            ydm DATE,
+            output TEXT
+        )
+    """
+    )
+    dates = [(start + timedelta(days=offset)).isoformat() for offset in range(days)]
+    per_day = max(1, rows // days)
+
+    def generate():
+        for number in range(rows):
+            roll = rng.random()
+            if roll < unscored:
+                output = None
+            elif roll < unscored + invalid:
+                output = "N/A"
+            else:
+                output = str(rng.randint(1, 100))
+            headline = f"{' '.join(rng.choices(WORDS, k=6))} #{number}"
+            yield headline, dates[min(number // per_day, days - 1)], output
+
+    rows_iter = generate()
+    while True:
+        chunk = [row for _, row in zip(range(chunk_rows), rows_iter)]
+        if not chunk:
+            break
+        with conn:
+            conn.executemany(
+                "INSERT INTO headlines (headline, ydm, output) VALUES (?, ?, ?)", chunk
+            )
+    conn.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_headlines_headline_ydm ON headlines (headline, ydm)"
+    )
+    conn.commit()
+    conn.close()
+
+
+def make_index_csv(path, days=9500, start=date(1998, 1, 1), seed=0):
+    """Write `days` calendar days of weekday closes as Date,Open,High,Low,Close,Adj Close,Volume."""
+    rng = random.Random(seed)
+    close = 20.0
+    with open(path, "w") as f:
+        f.write("Date,Open,High,Low,Close,Adj Close,Volume\n")
+        for offset in range(days):
+            day = start + timedelta(days=offset)
+            if day.weekday() >= 5:
+                continue
+            open_ = close
+            close = max(5.0, close * (1 + rng.gauss(0, 0.05)))
+            high, low = max(open_, close) * 1.02, min(open_, close) * 0.98
+            f.write(f"{day.isoformat()},{open_:.2f},{high:.2f},{low:.2f},{close:.2f},{close:.2f},0\n")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path")
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--days", type=int, default=9500)
+    parser.add_argument("--unscored", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    make_db(args.path, args.rows, args.days, unscored=args.unscored, seed=args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Compare per-day insert_data() commits with the batched HeadlineWriter.
+
+    python -m benchmarks.writer --days 2000
+
+Both write the same synthetic days into fresh databases in a temporary
+directory and report rows/sec.
+"""
+import argparse
+import contextlib
+import io
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import headlines
+from benchmarks.servers import archive_day
+
+
+def synthetic_days(count):
+    start = datetime(2000, 1, 1)
+    for offset in range(count):
+        date = start + timedelta(days=offset)
+        pages = archive_day(date.year, date.month, date.day)
+        yield [h for page in pages for h in page], date.strftime("%Y-%m-%d"), len(pages)
+
+
+def run(db, write, days):
+    headlines.DB = str(db)
+    headlines.create_table()
+    rows = sum(len(day[0]) for day in days)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        write(days)
+    return rows / (time.perf_counter() - start)
+
+
+def per_day(days):
+    for day in days:
+        headlines.insert_data(*day)
+
+
+def batched(days):
+    writer = headlines.HeadlineWriter().start()
+    for day in days:
+        writer.put(*day)
+    writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days", type=int, default=1000)
+    args = parser.parse_args()
+    days = list(synthetic_days(args.days))
+    with tempfile.TemporaryDirectory() as tmp:
+        baseline = run(Path(tmp) / "per_day.db", per_day, days)
+        writer = run(Path(tmp) / "batched.db", batched, days)
+    print(f"insert_data (connect + commit per day): {baseline:10.0f} rows/sec")
+    print(f"HeadlineWriter (batched, WAL):          {writer:10.0f} rows/sec ({writer / baseline:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
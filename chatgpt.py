@@ -1,30 +1,34 @@
-from openai import OpenAI
+"""Score headlines with the OpenAI chat completions API.
+
+The scoring, rate-limit and cost code is importable on its own:
+
+    from chatgpt import Scorer, ScorerConfig
+    scorer = Scorer(ScorerConfig(db="headlines.db", requests_per_minute=500))
+    scorer.score_concurrently(workers=8)
+
+Nothing is parsed at import time, and requests, tenacity and tiktoken are only
+imported by the paths that send requests or count tokens, so `--status` and
+the argument parsing of every other mode start without them.
+"""
 import os
-import tiktoken
 import sqlite3
+from dataclasses import dataclass
 from decimal import Decimal, getcontext
-from tenacity import retry, stop_after_attempt, wait_random_exponential
-from datetime import datetime, timedelta
+from datetime import datetime
 import time
-import requests
 import re
-import sys
 import argparse
-
-# Create the parser
-parser = argparse.ArgumentParser()
-parser.add_argument(
-    "-v", "--verbose", action="store_true", help="Increase output verbosity"
-)
-parser.add_argument(
-    "-c", "--calculate", action="store_true", help="Calculate Total Tokens and Price"
-)
-parser.add_argument(
-    "-t", "--test", action="store_true", help="Do a test"
-)
-args = parser.parse_args()
-
-## TODO: organize with classes
+import threading
+import json
+from itertools import groupby
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import metrics
+from batch_jobs import API_BASE, BATCH_DIR, BatchClient, run_bulk
+from cost_estimate import estimate_db_tokens, get_encoding
+from response_cache import RESPONSE_CACHE_DB, RESPONSE_CACHE_MAX_ENTRIES, ResponseCache
+from work_queue import WorkQueue
+from rate_limit import RateLimiter
 
 API_KEY = os.getenv("OPENAI_API_KEY")
 GPT_MODEL = "gpt-4-0125-preview" # "gpt-3.5-turbo"
@@ -35,100 +39,103 @@ GPT_RETRY_WRONG_OUTPUT_LIMIT = 200
 DB = "headlines.db"
 GPT_ENDPOINT = "https://api.openai.com/v1/chat/completions"
 GPT_REQUESTS_PER_MINUTE = 250
+GPT_TOKENS_PER_MINUTE = 150000
+GPT_EXPECTED_OUTPUT_TOKENS = 2  # A score of 1-100 is one or two tokens
+GPT_RETRY_ERROR_LIMIT = 10  # Error responses tolerated per headline before skipping it
+GPT_TIMEOUT = 60
+GPT_MAX_RATE_LIMIT_PAUSE = 60  # Longest back-off taken from a 429, whatever the message says
 getcontext().prec = 22
-request_counters = {
-    "limit_requests": 60,
-    "limit_tokens": 150000,
-    "remaining_requests": 60,
-    "remaining_tokens": 150000,
-    "reset_requests": datetime.now() + timedelta(seconds=1),
-    "reset_tokens": datetime.now() + timedelta(minutes=6),
-}
-rpm_next_time = Decimal(0)
-last_request_time = datetime.now().strftime("%H:%M:%S")
+COMPLETION_SECONDS = metrics.histogram("score_completion_seconds", "Chat completion round-trip latency")
+RATE_LIMIT_WAIT_SECONDS = metrics.histogram("score_rate_limit_wait_seconds", "Sleep imposed by RPM/TPM limits and 429 back-offs")
+INVALID_OUTPUTS = metrics.counter("score_invalid_outputs_total", "Completions that were not a 1-100 score and were retried")
+BATCH_FALLBACKS = metrics.counter("score_batch_fallbacks_total", "Batch items re-scored with a single-headline request")
+ERROR_RESPONSES = metrics.counter("score_error_responses_total", "Completion requests that returned no completion")
+CACHE_HITS = metrics.counter("score_cache_hits_total", "Prompts answered from the response cache")
+PROMPT_TEMPLATE = "Forget all previous instructions. You are now a financial expert analyzing the stock market in {month}/{year}. Upon receiving a news headline, assess its impact on {stock_index} prices. Predict whether the headline suggests a rise or drop in prices by providing a number on a scale from 1 to 100, where 1 signifies a significant decrease, 100 signifies a significant increase, and 50 indicates uncertainty. Your response should be limited to this numerical prediction only, based on the given headline: {headline}"
+
+BATCH_PROMPT_TEMPLATE = "Forget all previous instructions. You are now a financial expert analyzing the stock market in {month}/{year}. Upon receiving a numbered list of news headlines, assess the impact of each one on {stock_index} prices. For every headline, predict whether it suggests a rise or drop in prices by providing a number on a scale from 1 to 100, where 1 signifies a significant decrease, 100 signifies a significant increase, and 50 indicates uncertainty. Your response should be limited to a JSON array of exactly {count} integers, one per headline and in the same order, based on the given headlines:\n{headlines}"
+
+
+@dataclass
+class ScorerConfig:
+    """Where to score, with which model, and within which limits."""
+
+    db: str = DB
+    api_key: str = API_KEY
+    model: str = GPT_MODEL
+    endpoint: str = GPT_ENDPOINT
+    stock_index: str = STOCK_INDEX
+    requests_per_minute: int = GPT_REQUESTS_PER_MINUTE
+    tokens_per_minute: int = GPT_TOKENS_PER_MINUTE
+    timeout: float = GPT_TIMEOUT
+    retry_wrong_output_limit: int = GPT_RETRY_WRONG_OUTPUT_LIMIT
+    retry_error_limit: int = GPT_RETRY_ERROR_LIMIT
+    token_cost_input: Decimal = TOKEN_COST_1_INPUT
+    token_cost_output: Decimal = TOKEN_COST_1_OUTPUT
+    verbose: bool = False
+
+
+def build_messages(year, month, headline, stock_index=STOCK_INDEX):
+    input_text = PROMPT_TEMPLATE.format(
+        month=month, year=year, stock_index=stock_index, headline=headline
+    )
+    return [{"role": "system", "content": input_text}]
+
+
+def build_batch_messages(year, month, headlines, stock_index=STOCK_INDEX):
+    numbered = "\n".join(
+        f"{number}. {headline}" for number, headline in enumerate(headlines, 1)
+    )
+    input_text = BATCH_PROMPT_TEMPLATE.format(
+        month=month,
+        year=year,
+        stock_index=stock_index,
+        count=len(headlines),
+        headlines=numbered,
+    )
+    return [{"role": "system", "content": input_text}]
 
 
 def convert_reset_time_to_seconds(time_str):
-    if args.verbose:
-        print("Em: ", "convert_to_seconds")
-    # This pattern will match hours, minutes, and seconds in the input string
-    pattern = r"(?:(\d+)h)?(?:(\d+)m)?(?:(\d+(?:\.\d+)?)s)?"
+    # This pattern will match hours, minutes, seconds and milliseconds in the input string
+    pattern = r"(?:(\d+)h)?(?:(\d+)m(?!s))?(?:(\d+(?:\.\d+)?)s)?(?:(\d+(?:\.\d+)?)ms)?"
     match = re.search(pattern, time_str)
 
     if match is None or match.group(0) == "":
         return False
 
-    hours, minutes, seconds = match.groups(default="0")
+    hours, minutes, seconds, milliseconds = match.groups(default="0")
     # Convert all to seconds and sum them up
-    total_seconds = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    total_seconds = int(hours) * 3600 + int(minutes) * 60 + float(seconds) + float(milliseconds) / 1000
 
     return total_seconds
 
 
-def update_rate_limit_counters(headers):
-    if args.verbose:
-        print("Em: ", "update_rate_limit_counters")
-    global request_counters
-    try:
-        request_counters["limit_requests"] = int(
-            headers.get("x-ratelimit-limit-requests", 60)  # rpd
-        )
-        request_counters["limit_tokens"] = int(
-            headers.get("x-ratelimit-limit-tokens", 150000)  # tpd
-        )
-        request_counters["remaining_requests"] = int(
-            headers.get("x-ratelimit-remaining-requests", 60)  # remaining rpd
-        )
-        request_counters["remaining_tokens"] = int(
-            headers.get("x-ratelimit-remaining-tokens", 150000)  # remaining tpd
-        )
-        reset_requests_seconds = int(
-            convert_reset_time_to_seconds(
-                headers.get("x-ratelimit-reset-requests", "1s")
-            )
-        )
-        reset_tokens_seconds = int(
-            convert_reset_time_to_seconds(
-                headers.get("x-ratelimit-reset-tokens", "360s")
-            )
-        )
-        request_counters["reset_requests"] = datetime.now() + timedelta(
-            seconds=reset_requests_seconds
-        )
-        request_counters["reset_tokens"] = datetime.now() + timedelta(
-            seconds=reset_tokens_seconds
-        )
-    except Exception as e:
-        print(f"Warning: Error in rate-limit headers: {headers}. Error: {e}")
-
-
-def wait_for_rate_limit_reset():
-    if args.verbose:
-        print("Em: ", "wait_for_rate_limit_reset")
-    """Wait until the rate limit resets."""
-    global request_counters
-    now = datetime.now()
-
-    wait_seconds_requests = (request_counters["reset_requests"] - now).total_seconds()
-    wait_seconds_tokens = (request_counters["reset_tokens"] - now).total_seconds()
-    wait_seconds = (
-        wait_seconds_requests
-        if wait_seconds_requests > wait_seconds_tokens
-        else wait_seconds_tokens
-    )
-
-    if wait_seconds > 0:
-        print(
-            f"Rate limit exceeded. Waiting for {wait_seconds} seconds until limit resets."
-        )
-        time.sleep(wait_seconds)
+def parse_rate_limit_headers(headers):
+    """Read the `x-ratelimit-*` headers that are present; reset times are in seconds."""
+    limits = {}
+    for key in (
+        "limit_requests",
+        "limit_tokens",
+        "remaining_requests",
+        "remaining_tokens",
+        "reset_requests",
+        "reset_tokens",
+    ):
+        header = "x-ratelimit-" + key.replace("_", "-")
+        value = headers.get(header)
+        if value is None:
+            continue
+        try:
+            limits[key] = int(convert_reset_time_to_seconds(value) if key.startswith("reset") else value)
+        except ValueError as e:
+            print(f"Warning: Error in rate-limit header {header}: {value!r}. Error: {e}")
+    return limits
 
 
 def log_retry_failure(
     retry_state,
 ):  # Define a callback function for retry errors to log the details
-    if args.verbose:
-        print("Em: ", "log_retry_failure")
     last_exception = retry_state.outcome.exception()
     if last_exception and hasattr(last_exception, "response"):
         response = last_exception.response
@@ -141,82 +148,20 @@ def log_retry_failure(
         )
 
 
-@retry(
-    wait=wait_random_exponential(min=1, max=60),
-    stop=stop_after_attempt(10),
-    retry_error_callback=log_retry_failure,
-)
-def attempt_fetch_completion(messages):
-    global last_request_time
-    if args.verbose:
-        print("Em: ", "attempt_fetch_completion")
-    headers = {
-        "Authorization": f"Bearer {API_KEY}",
-        "Content-Type": "application/json",
-    }
-    data = {
-        "model": GPT_MODEL,
-        "messages": messages,
-    }
-    response = requests.post(GPT_ENDPOINT, json=data, headers=headers)
-    last_request_time = datetime.now().strftime("%H:%M:%S")
-    update_rate_limit_counters(
-        response.headers
-    )  # Update rate limit counters based on the response headers
-    return response.json()
+def with_retries(call, *args):
+    """call(*args) with exponential back-off; None once 10 attempts have failed."""
+    from tenacity import Retrying, stop_after_attempt, wait_random_exponential
 
-
-def fetch_completion(messages):
-    if args.verbose:
-        print("Em: ", "fetch_completion")
-
-    tokens_needed = num_tokens_from_messages(messages)
-
-    # Checking remaining tokens with headers data
-    if (
-        request_counters["remaining_tokens"] < tokens_needed
-        or request_counters["remaining_requests"] <= 0
-    ):
-        wait_for_rate_limit_reset()
-
-    json_response = attempt_fetch_completion(messages)
-
-    return json_response
-
-
-def make_request_with_rate_limit(messages):
-    global rpm_next_time
-
-    rps = Decimal(GPT_REQUESTS_PER_MINUTE) / Decimal(
-        60
-    )  # Requests per second (RPM / 60)
-    interval = Decimal(1) / rps  # Interval between requests
-
-    if rpm_next_time == Decimal(0):
-        rpm_next_time = Decimal(time.time()) + interval
-
-    now = Decimal(time.time())
-    if now >= rpm_next_time:
-        json_response = fetch_completion(messages)  # Your existing request function
-        rpm_next_time = now + interval
-        delay_correction = rpm_next_time - Decimal(time.time())
-        if delay_correction > 0:
-            time.sleep(float(delay_correction))  # Sleep to adjust the request rate
-        return json_response
-    else:
-        # Delay until the next calculated time if called too early
-        time.sleep(float(rpm_next_time - now))
-        return make_request_with_rate_limit(messages)
+    retrying = Retrying(
+        wait=wait_random_exponential(min=1, max=60),
+        stop=stop_after_attempt(10),
+        retry_error_callback=log_retry_failure,
+    )
+    return retrying(call, *args)
 
 
-def num_tokens_from_messages(messages):
-    if args.verbose:
-        print("Em: ", "num_tokens_from_messages")
-    try:
-        encoding = tiktoken.encoding_for_model(GPT_MODEL)
-    except ValueError:
-        print("Warning: model not found. Using cl100k_base encoding.")
-        encoding = tiktoken.get_encoding("cl100k_base")
+def num_tokens_from_messages(messages, model=GPT_MODEL):
+    encoding = get_encoding(model)
 
     tokens_per_message = 3
     tokens_per_name = 1
@@ -232,164 +177,528 @@ def num_tokens_from_messages(messages):
     return num_tokens
 
 
-def num_tokens_from_string(string: str) -> int:
-    if args.verbose:
-        print("Em: ", "num_tokens_from_string")
-    try:
-        encoding = tiktoken.encoding_for_model(GPT_MODEL)
-    except ValueError:
-        print("Warning: model not found. Using cl100k_base encoding.")
-        encoding = tiktoken.get_encoding("cl100k_base")
+def num_tokens_from_string(string: str, model=GPT_MODEL) -> int:
+    encoding = get_encoding(model)
     num_tokens = len(encoding.encode(string))
     return num_tokens
 
 
-def calculate_cost(input_message: list, output_text: str) -> Decimal:
-    input_cost = num_tokens_from_messages(input_message) * TOKEN_COST_1_INPUT
-    output_cost = num_tokens_from_string(output_text) * TOKEN_COST_1_OUTPUT
-
-    total_cost = input_cost + output_cost
-    if args.verbose:
-        print(f"total_cost = {total_cost}")
-    return total_cost
-
-
-def get_headlines_by_year(cursor):
-    if args.verbose:
-        print("Em: ", "get_headlines_by_year")
-    query = "SELECT id, strftime('%Y', ydm) AS year, strftime('%m', ydm) AS month, headline FROM headlines ORDER BY ydm ASC"
-    cursor.execute(query)
-    row_count = 0  # Debugging
-    while True:
-        row = cursor.fetchone()
-        if row is None:
-            break
-        row_count += 1  # Debugging
-        yield row
-
-
-def insert_output_data(conn, id, output_text):
-    if args.verbose:
-        print("Em: ", "insert_output_data")
-    local_cursor = conn.cursor()
-    local_cursor.execute(
-        "UPDATE headlines SET output = ? WHERE id = ?", (output_text, id)
-    )
+def count_tokens(messages, output_text, model=GPT_MODEL):
+    return num_tokens_from_messages(messages, model) + num_tokens_from_string(output_text, model)
+
 
+def read_completion(response):
+    """Return (output_text, retry_after, used_tokens) from a completion response.
 
-def is_response_ok(completion):
+    output_text is None for error responses; retry_after is the number of
+    seconds the API asked us to back off for, if it reported a rate limit.
+    """
+    try:
+        completion = response.json()
+    except ValueError:
+        completion = {}
     try:
         output_text = completion["choices"][0]["message"]["content"]
-        ok = True
-    except Exception as e:
-        if (
-            "error" in completion
-            and "message" in completion["error"]
-            and "Rate limit" in completion["error"]["message"]
-        ):
-            time_raw = re.search(
-                r"(?<=Please try again in ).*?(?=\. Visit)",
-                completion["error"]["message"],
-            ).group(0)
-            if args.verbose:
-                print("is_response_ok(), time_raw: ", time_raw)
-            match = convert_reset_time_to_seconds(time_raw)
-            if args.verbose:
-                print("is_response_ok(), match: ", match)
-            print(f"Warning: Error in response: {completion}. Error: {e}")
-            if match and isinstance(match, float):
-                print(f"Sleeping time: {match}")
-                time.sleep(match)
-            else:
-                msg = input("Deseja parar o programa? (s/n)").lower()
-                if msg == "s" or msg == "sim":
-                    sys.exit()
-        output_text = ""
-        ok = False
-    return output_text, ok
-
-
-def main():
-    cost = Decimal("0")
-    done_count = 0
-    retry_count_wrong_output = 0
-
-    with sqlite3.connect(DB) as conn:
-        cursor = conn.cursor()
-        for id, year, month, headline in get_headlines_by_year(cursor):
-            if args.verbose:
-                print("Em: ", "for id, year, month, headline")
-            while True:
-                input_text = f"Forget all previous instructions. You are now a financial expert analyzing the stock market in {month}/{year}. Upon receiving a news headline, assess its impact on {STOCK_INDEX} prices. Predict whether the headline suggests a rise or drop in prices by providing a number on a scale from 1 to 100, where 1 signifies a significant decrease, 100 signifies a significant increase, and 50 indicates uncertainty. Your response should be limited to this numerical prediction only, based on the given headline: {headline}"
-                messages = [{"role": "system", "content": input_text}]
-                completion = make_request_with_rate_limit(messages)
-                output_text, ok = is_response_ok(completion)
-                if not ok:
-                    continue  # Continua o loop para tentar novamente
-                try:
-                    number = int(output_text)
-                    if 1 <= number <= 100:
-                        insert_output_data(conn, id, number)
+        return output_text, None, completion.get("usage", {}).get("total_tokens")
+    except (KeyError, IndexError, TypeError, AttributeError):
+        pass
+    if not isinstance(completion, dict):
+        completion = {}
+    error = completion.get("error")
+    message = str(error.get("message", "") if isinstance(error, dict) else error or "")
+    if "Rate limit" in message or response.status_code == 429:
+        match = re.search(r"(?<=Please try again in ).*?(?=\. Visit)", message)
+        seconds = convert_reset_time_to_seconds(match.group(0)) if match else False
+        if not seconds:
+            try:
+                seconds = float(response.headers.get("retry-after", 1))
+            except ValueError:  # An HTTP date rather than seconds
+                seconds = 1
+        return None, min(seconds, GPT_MAX_RATE_LIMIT_PAUSE), None
+    return None, None, None
+
+
+def parse_batch_scores(output_text, count):
+    """Read a JSON array of `count` scores; invalid items come back as None.
+
+    If the array is missing or has the wrong length, the scores cannot be
+    matched to their headlines and every item is None.
+    """
+    invalid = [None] * count
+    start, end = output_text.find("["), output_text.rfind("]")
+    if start == -1 or end < start:
+        return invalid
+    try:
+        values = json.loads(output_text[start : end + 1])
+    except ValueError:
+        return invalid
+    if not isinstance(values, list) or len(values) != count:
+        return invalid
+    scores = []
+    for value in values:
+        if isinstance(value, str) and value.strip().isdigit():
+            value = int(value)
+        if isinstance(value, int) and not isinstance(value, bool) and 1 <= value <= 100:
+            scores.append(value)
+        else:
+            scores.append(None)
+    return scores
+
+
+def iter_month_batches(rows, batch_size):
+    """Group consecutive rows of the same month into lists of at most `batch_size`."""
+    for (year, month), month_rows in groupby(rows, key=lambda row: (row[1], row[2])):
+        batch = []
+        for row in month_rows:
+            batch.append(row)
+            if len(batch) == batch_size:
+                yield year, month, batch
+                batch = []
+        if batch:
+            yield year, month, batch
+
+
+def make_session(pool_size):
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class Scorer:
+    """Scores the unscored rows of `config.db`, serially or with requests in flight.
+
+    Retry tallies and the optional ResponseCache live on the instance, and each
+    run has its own RateLimiter, so several scorers with their own configs can
+    run side by side.
+    """
+
+    def __init__(self, config=None, response_cache=None):
+        self.config = config or ScorerConfig()
+        self.response_cache = response_cache
+        self.retry_count_wrong_output = 0
+        self.batch_fallbacks = 0
+        self.wrong_output_lock = threading.Lock()
+
+    def build_messages(self, year, month, headline):
+        return build_messages(year, month, headline, self.config.stock_index)
+
+    def completion_request(self, messages):
+        """Keyword arguments for POSTing `messages` to the completions endpoint."""
+        return {
+            "json": {"model": self.config.model, "messages": messages},
+            "headers": {
+                "Authorization": f"Bearer {self.config.api_key}",
+                "Content-Type": "application/json",
+            },
+        }
+
+    def calculate_cost(self, input_message: list, output_text: str) -> Decimal:
+        input_cost = num_tokens_from_messages(input_message, self.config.model) * self.config.token_cost_input
+        output_cost = num_tokens_from_string(output_text, self.config.model) * self.config.token_cost_output
+
+        total_cost = input_cost + output_cost
+        if self.config.verbose:
+            print(f"total_cost = {total_cost}")
+        return total_cost
+
+    def score_serially(self, distinct=False, since=None):
+        """Score one headline at a time, through the same limiter and retries as score_concurrently()."""
+        cost = Decimal("0")
+        done_count = 0
+        limiter = RateLimiter(self.config.requests_per_minute, self.config.tokens_per_minute)
+        session = make_session(1)
+
+        queue = WorkQueue(self.config.db, distinct=distinct, since=since)
+        try:
+            for id, year, month, headline in queue.rows():
+                scores, row_cost, _, _ = self.score_rows(
+                    session, limiter, year, month, [(id, year, month, headline)]
+                )
+                for id, number in scores:
+                    if number is not None:
+                        queue.write(id, number)
                         done_count += 1
-                        break
-                    else:
-                        if retry_count_wrong_output >= GPT_RETRY_WRONG_OUTPUT_LIMIT:
-                            print(
-                                f"O GPT_RETRY_WRONG_OUTPUT_LIMIT = {GPT_RETRY_WRONG_OUTPUT_LIMIT} foi atingido!\n"
-                            )
+                cost += row_cost
+                print(
+                    f"\rCOMPLETED: {done_count} - SAVED: {queue.rows_written} - TOTAL COST: ${cost} - WRONG OUTPUTS: {self.retry_count_wrong_output} - RATE-LIMIT WAIT: {limiter.waited_seconds:.1f}s. ",
+                    end="",
+                )
+        finally:
+            queue.close()
+
+    def post_completion(self, session, messages):
+        return with_retries(self.send_completion, session, messages)
+
+    def send_completion(self, session, messages):
+        return session.post(
+            self.config.endpoint, timeout=self.config.timeout, **self.completion_request(messages)
+        )
+
+    def request_completion(self, session, limiter, messages, expected_output_tokens):
+        """Send `messages` through the limiter until a completion arrives; returns its text.
+
+        Returns None once `config.retry_error_limit` error responses have been seen.
+        """
+        tokens_needed = num_tokens_from_messages(messages, self.config.model) + expected_output_tokens
+        errors = 0
+        while True:
+            waited = limiter.acquire(tokens_needed)
+            if waited:
+                RATE_LIMIT_WAIT_SECONDS.observe(waited)
+            with COMPLETION_SECONDS.time():
+                response = self.post_completion(session, messages)
+            if response is None:
+                output_text, retry_after, used_tokens = None, None, None
+            else:
+                limiter.update(parse_rate_limit_headers(response.headers))
+                output_text, retry_after, used_tokens = read_completion(response)
+                if used_tokens is not None:
+                    limiter.settle(tokens_needed, used_tokens)
+            if output_text is not None:
+                return output_text
+            errors += 1
+            ERROR_RESPONSES.inc()
+            if retry_after:
+                RATE_LIMIT_WAIT_SECONDS.observe(retry_after)
+                limiter.pause(retry_after)
+            elif errors >= self.config.retry_error_limit:
+                return None
+            else:
+                time.sleep(min(60, 2**errors))
+
+    def score_headline(self, session, limiter, year, month, headline):
+        """Ask for a score until a valid 1-100 number arrives.
+
+        Returns (number, messages, output_text, cached); number is None when the
+        shared wrong-output limit or the error limit is hit.
+        """
+        model = self.config.model
+        messages = self.build_messages(year, month, headline)
+        if self.response_cache is not None:
+            output_text = self.response_cache.get(model, messages)
+            if output_text is not None:
+                CACHE_HITS.inc()
+                return int(output_text), messages, output_text, True
+        while True:
+            output_text = self.request_completion(
+                session, limiter, messages, GPT_EXPECTED_OUTPUT_TOKENS
+            )
+            if output_text is None:
+                return None, messages, "", False
+            try:
+                number = int(output_text)
+                if 1 <= number <= 100:
+                    if self.response_cache is not None:
+                        self.response_cache.put(model, messages, output_text)
+                    return number, messages, output_text, False
+            except ValueError:
+                pass
+            with self.wrong_output_lock:
+                if self.retry_count_wrong_output >= self.config.retry_wrong_output_limit:
+                    return None, messages, output_text, False
+                self.retry_count_wrong_output += 1
+            INVALID_OUTPUTS.inc()
+
+    def score_rows(self, session, limiter, year, month, rows):
+        """Score rows of one month in a single request, falling back per item.
+
+        Returns (scores, cost, tokens_used, tokens_single), where scores is a list
+        of (id, number) and tokens_single is what one request per headline would
+        have used.
+        """
+        model = self.config.model
+        if len(rows) == 1:
+            id, _, _, headline = rows[0]
+            number, messages, output_text, cached = self.score_headline(
+                session, limiter, year, month, headline
+            )
+            if cached:
+                return [(id, number)], Decimal("0"), 0, 0
+            tokens = count_tokens(messages, output_text, model)
+            return [(id, number)], self.calculate_cost(messages, output_text), tokens, tokens
+
+        messages = build_batch_messages(year, month, [row[3] for row in rows], self.config.stock_index)
+        output_text = None
+        if self.response_cache is not None:
+            output_text = self.response_cache.get(model, messages)
+        if output_text is not None:
+            CACHE_HITS.inc()
+            numbers = parse_batch_scores(output_text, len(rows))
+            cost = Decimal("0")
+            tokens_used = 0
+        else:
+            output_text = self.request_completion(
+                session, limiter, messages, len(rows) * GPT_EXPECTED_OUTPUT_TOKENS + 2
+            )
+            output_text = output_text or ""
+            numbers = parse_batch_scores(output_text, len(rows))
+            if self.response_cache is not None and None not in numbers:
+                self.response_cache.put(model, messages, output_text)
+            cost = self.calculate_cost(messages, output_text)
+            tokens_used = count_tokens(messages, output_text, model)
+        tokens_single = 0
+        scores = []
+        for (id, _, _, headline), number in zip(rows, numbers):
+            if number is None:
+                with self.wrong_output_lock:
+                    self.batch_fallbacks += 1
+                BATCH_FALLBACKS.inc()
+                number, single_messages, single_output, cached = self.score_headline(
+                    session, limiter, year, month, headline
+                )
+                if not cached:
+                    cost += self.calculate_cost(single_messages, single_output)
+                    tokens_used += count_tokens(single_messages, single_output, model)
+            tokens_single += count_tokens(
+                self.build_messages(year, month, headline), str(number or 50), model
+            )
+            scores.append((id, number))
+        return scores, cost, tokens_used, tokens_single
+
+    def score_concurrently(self, workers, batch_size=1, distinct=False, since=None):
+        """Score every headline with up to `workers` requests in flight.
+
+        Admission is controlled by a RateLimiter covering both RPM and TPM, fed
+        from the `x-ratelimit-*` headers of every response. With `batch_size` > 1,
+        each request scores up to that many headlines of the same month. With
+        `distinct`, repeated headlines within a month are scored once and the
+        score is fanned out to every copy. With `since` (YYYY-MM-DD), only
+        rows from that day on are scored. Rows come from, and scores go back
+        through, a WorkQueue on this thread only.
+        """
+        cost = Decimal("0")
+        done_count = 0
+        tokens_used = 0
+        tokens_single = 0
+        limiter = RateLimiter(self.config.requests_per_minute, self.config.tokens_per_minute)
+        session = make_session(workers)
+
+        queue = WorkQueue(self.config.db, distinct=distinct, since=since)
+        batches = iter_month_batches(queue.rows(), batch_size)
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                pending = set()
+                exhausted = False
+                while pending or not exhausted:
+                    # Keep a bounded number of requests queued ahead of the workers
+                    while not exhausted and len(pending) < workers * 2:
+                        batch = next(batches, None)
+                        if batch is None:
+                            exhausted = True
                             break
-                        raise ValueError
-                except ValueError:
-                    retry_count_wrong_output += 1
+                        pending.add(executor.submit(self.score_rows, session, limiter, *batch))
+                    if not pending:
+                        break
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        scores, batch_cost, batch_tokens, batch_tokens_single = future.result()
+                        for id, number in scores:
+                            if number is not None:
+                                queue.write(id, number)
+                                done_count += 1
+                        cost += batch_cost
+                        tokens_used += batch_tokens
+                        tokens_single += batch_tokens_single
+                    saved = (tokens_single - tokens_used) / done_count if done_count else 0
                     print(
-                        f"\rNúmero inválido recebido. Tentando novamente... Tentativa: {retry_count_wrong_output}",
+                        f"\rCOMPLETED: {done_count} - SAVED: {queue.rows_written} - TOTAL COST: ${cost} - WRONG OUTPUTS: {self.retry_count_wrong_output} - BATCH FALLBACKS: {self.batch_fallbacks} - TOKENS SAVED/HEADLINE: {saved:.1f} - RATE-LIMIT WAIT: {limiter.waited_seconds:.1f}s. ",
                         end="",
                     )
-                    continue  # Continua o loop para tentar novamente
+        finally:
+            queue.close()
+
+    def score(self, workers=8, batch_size=1, distinct=False, since=None):
+        """score_concurrently(), or the serial loop for one worker and single-headline prompts."""
+        if workers > 1 or batch_size > 1:
+            self.score_concurrently(workers, batch_size, distinct, since)
+        else:
+            self.score_serially(distinct, since)
+
+
+def db_status(db=DB):
+    """Row counts of `db`, and the date range still waiting for a score."""
+    with sqlite3.connect(db) as conn:
+        total = conn.execute("SELECT COUNT(*) FROM headlines").fetchone()[0]
+        unscored, first, last = conn.execute(
+            "SELECT COUNT(*), MIN(ydm), MAX(ydm) FROM headlines WHERE output IS NULL"
+        ).fetchone()
+    return {
+        "headlines": total,
+        "scored": total - unscored,
+        "unscored": unscored,
+        "first_unscored": first,
+        "last_unscored": last,
+    }
 
-            cost += calculate_cost(messages, output_text)
-            print(
-                f"\rCOMPLETED: {done_count} - TOTAL COST: ${cost} - WRONG OUTPUTS: {retry_count_wrong_output} - LAST REQUEST TIME: {last_request_time}. ",
-                end="",
-            )
 
+def prompt_prefix(year, month, stock_index=STOCK_INDEX):
+    return PROMPT_TEMPLATE.format(
+        month=month, year=year, stock_index=stock_index, headline=""
+    )
+
+
+def calculate_db_cost(config=None):
+    config = config or ScorerConfig()
+    assert PROMPT_TEMPLATE.endswith("{headline}"), "the estimate needs the headline last"
+    total_headlines, tokens_input, tokens_output = estimate_db_tokens(
+        config.db,
+        config.model,
+        lambda year, month: prompt_prefix(year, month, config.stock_index),
+        "100",
+    )
+    cost = tokens_input * config.token_cost_input + tokens_output * config.token_cost_output
+    print(
+        f"total_headlines: '{total_headlines}', model: '{config.model}', total_cost: '{cost}', tokens_input: '{tokens_input}', tokens_output: '{tokens_output}'"
+    )
+    return cost
 
-def count_rows_in_headlines():
-    conn = sqlite3.connect(DB)
-    cur = conn.cursor()
-    cur.execute("SELECT COUNT(*) FROM headlines")
-    rows_count = cur.fetchone()[0]
-    conn.close()
-    return rows_count
-
-
-def calculate_db_cost():
-    cost = Decimal("0")
-    tokens_output = 0
-    tokens_input = 0
-    total_headlines = count_rows_in_headlines()
-    remaining_headlines = total_headlines
-    with sqlite3.connect(DB) as conn:
-        cursor = conn.cursor()
-        for id, year, month, headline in get_headlines_by_year(cursor):
-            input_text = f"Forget all previous instructions. You are now a financial expert analyzing the stock market in {month}/{year}. Upon receiving a news headline, assess its impact on {STOCK_INDEX} prices. Predict whether the headline suggests a rise or drop in prices by providing a number on a scale from 1 to 100, where 1 signifies a significant decrease, 100 signifies a significant increase, and 50 indicates uncertainty. Your response should be limited to this numerical prediction only, based on the given headline: {headline}"
-            cost += calculate_cost([{"role": "system", "content": input_text}], "100")
-            tokens_input += num_tokens_from_messages(
-                [{"role": "system", "content": input_text}]
-            )
-            tokens_output += num_tokens_from_string("100")
-            remaining_headlines -= 1
-            print(
-                f"\rtotal_headlines: '{total_headlines}', remaining_headlines: {remaining_headlines}, model: '{GPT_MODEL}', total_cost: '{cost}', tokens_input: '{tokens_input}', tokens_output: '{tokens_output}'", end=''
-            )
 
 def test():
     return
 
+
+# Create the parser
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "-v", "--verbose", action="store_true", help="Increase output verbosity"
+)
+parser.add_argument(
+    "-c", "--calculate", action="store_true", help="Calculate Total Tokens and Price"
+)
+parser.add_argument(
+    "-s", "--status", action="store_true", help="Print scored and unscored row counts"
+)
+parser.add_argument(
+    "-t", "--test", action="store_true", help="Do a test"
+)
+parser.add_argument("--db", default=DB, help="Headlines database to score")
+parser.add_argument(
+    "-w",
+    "--workers",
+    type=int,
+    default=8,
+    help="Requests in flight at once (1 keeps the original serial loop)",
+)
+parser.add_argument(
+    "-b",
+    "--batch-size",
+    type=int,
+    default=1,
+    help="Headlines of the same month scored per request",
+)
+parser.add_argument(
+    "--dedup",
+    action="store_true",
+    help="Score each distinct headline once per month and copy the score to its repeats",
+)
+parser.add_argument(
+    "--since",
+    type=lambda s: datetime.strptime(s, "%Y-%m-%d").strftime("%Y-%m-%d"),
+    help="Only score unscored rows from this day on (YYYY-MM-DD)",
+)
+parser.add_argument(
+    "--response-cache",
+    default=RESPONSE_CACHE_DB,
+    help="SQLite file caching validated completions by model and prompt",
+)
+parser.add_argument(
+    "--response-cache-max",
+    type=int,
+    default=RESPONSE_CACHE_MAX_ENTRIES,
+    help="Evict least recently used cached completions beyond this many",
+)
+parser.add_argument(
+    "--no-response-cache", action="store_true", help="Don't read or write the response cache"
+)
+parser.add_argument(
+    "--bulk",
+    action="store_true",
+    help="Score unscored headlines through the Batch API instead of live requests",
+)
+parser.add_argument(
+    "--bulk-dir", default=BATCH_DIR, help="Where --bulk writes its request files"
+)
+parser.add_argument(
+    "--api-base", default=API_BASE, help="Files/Batches API root for --bulk"
+)
+parser.add_argument(
+    "--endpoint", default=GPT_ENDPOINT, help="Chat completions URL, e.g. a local mock server"
+)
+parser.add_argument(
+    "--requests-per-minute",
+    type=int,
+    default=GPT_REQUESTS_PER_MINUTE,
+    help="Client-side request limit",
+)
+parser.add_argument(
+    "--tokens-per-minute",
+    type=int,
+    default=GPT_TOKENS_PER_MINUTE,
+    help="Client-side token limit",
+)
+parser.add_argument(
+    "--metrics",
+    metavar="PATH",
+    help="Export timings and counters here (.prom/.txt: Prometheus text, else JSON)",
+)
+parser.add_argument(
+    "--metrics-interval",
+    type=float,
+    default=metrics.EXPORT_SECONDS,
+    help="Seconds between metrics exports",
+)
+
+
+def config_from_args(args):
+    return ScorerConfig(
+        db=args.db,
+        endpoint=args.endpoint,
+        requests_per_minute=args.requests_per_minute,
+        tokens_per_minute=args.tokens_per_minute,
+        verbose=args.verbose,
+    )
+
+
+def cli(argv=None):
+    args = parser.parse_args(argv)
+    config = config_from_args(args)
+    if args.status:
+        for key, value in db_status(config.db).items():
+            print(f"{key}: {value}")
+        return
+    exporter = metrics.start_export(args.metrics, args.metrics_interval)
+    try:
+        if args.calculate:
+            calculate_db_cost(config)
+        elif args.test:
+            test()
+        elif args.bulk:
+            run_bulk(
+                config.db,
+                BatchClient(config.api_key, args.api_base),
+                Scorer(config).build_messages,
+                config.model,
+                args.bulk_dir,
+            )
+        else:
+            response_cache = None
+            if not args.no_response_cache:
+                response_cache = ResponseCache(args.response_cache, args.response_cache_max)
+            try:
+                Scorer(config, response_cache).score(args.workers, args.batch_size, args.dedup, args.since)
+            finally:
+                if response_cache is not None:
+                    print("\n" + response_cache.report())
+                    response_cache.close()
+    finally:
+        if exporter is not None:
+            exporter.stop()
+
+
 if __name__ == "__main__":
-    if args.calculate:
-        calculate_db_cost()
-    elif args.test:
-        test()
-    else:
-        main()
+    cli()
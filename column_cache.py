@@ -0,0 +1,87 @@
+"""Columnar on-disk cache of daily series as memory-mapped NumPy arrays.
+
+Each entry is a directory of `.npy` files, one per column, plus a `meta.json`
+recording the modification time and size of every source file the columns
+were built from. A `Day` column of int64 day numbers (days since 1970-01-01)
+keys every row, so joins between series are integer operations. An entry is
+rebuilt only when one of its sources changes; otherwise loading it is a
+handful of `np.load(..., mmap_mode="r")` calls with no parsing at all.
+"""
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+CACHE_DIR = "column_cache"
+
+
+def day_numbers(dates):
+    """Convert dates (strings, datetimes or datetime64) to int64 days since the epoch."""
+    return np.asarray(dates, dtype="datetime64[D]").astype(np.int64)
+
+
+def source_stamp(paths):
+    """(path, mtime_ns, size) for each source; a missing file is stamped as None."""
+    stamp = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            stamp.append([str(path), None, None])
+        else:
+            stamp.append([str(path), stat.st_mtime_ns, stat.st_size])
+    return stamp
+
+
+def entry_key(kind, path):
+    """Cache key for a series built from `path`, stable across working directories."""
+    digest = hashlib.sha1(str(Path(path).resolve()).encode()).hexdigest()[:12]
+    return f"{kind}-{Path(path).stem}-{digest}"
+
+
+class ColumnCache:
+    def __init__(self, root=CACHE_DIR):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.hits = 0
+        self.builds = 0
+
+    def load(self, key, sources, build):
+        """Return {column: array} for `key`, calling build() to regenerate it if any source changed.
+
+        build() returns a dict of equal-length 1-D arrays. Sources are stamped before building,
+        so a source that changes mid-build invalidates the entry on the next load.
+        """
+        entry = self.root / key
+        stamp = source_stamp(sources)
+        try:
+            meta = json.loads((entry / "meta.json").read_text())
+        except (FileNotFoundError, ValueError):
+            meta = None
+        if meta is not None and meta["sources"] == stamp:
+            try:
+                columns = {
+                    name: np.load(entry / f"{name}.npy", mmap_mode="r")
+                    for name in meta["columns"]
+                }
+            except (FileNotFoundError, ValueError):
+                pass
+            else:
+                self.hits += 1
+                return columns
+
+        columns = {name: np.ascontiguousarray(values) for name, values in build().items()}
+        entry.mkdir(parents=True, exist_ok=True)
+        # meta.json goes last: until it's replaced, the entry stays stale and is rebuilt
+        for name, values in columns.items():
+            tmp = entry / f"{name}.npy.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                np.save(f, values)
+            os.replace(tmp, entry / f"{name}.npy")
+        tmp = entry / f"meta.json.{os.getpid()}.tmp"
+        tmp.write_text(json.dumps({"sources": stamp, "columns": list(columns)}))
+        os.replace(tmp, entry / "meta.json")
+        self.builds += 1
+        return columns
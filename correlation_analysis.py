@@ -1,28 +1,57 @@
+import argparse
+import hashlib
+import math
+import os
+import re
 import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import shared_memory
+from pathlib import Path
 import pandas as pd
-import matplotlib.pyplot as plt
-from fpdf import FPDF
 import numpy as np
-from scipy.stats import pearsonr
+from scipy.stats import pearsonr, t as student_t
+
+import metrics
+from column_cache import CACHE_DIR as COLUMN_CACHE_DIR, ColumnCache, day_numbers, entry_key
+from headline_index import FTS_TABLE, ensure_fts, query_error
+from reports import HEXBIN_THRESHOLD, build_pdf, render_figures
 
 # Database and CSV file paths
 DB_PATH = "headlines.db"
 VIX_CSV_PATH = "VIX.csv"
+RANKING_CSV_PATH = "index_correlation_ranking.csv"
 BATCH_SIZE = 50000  # Process data in batches to manage memory
+ROLLING_WINDOWS = range(10, 260, 10)  # Rolling window lengths, in observations (trading days)
+LAGS = range(-20, 21)  # Pair the score at t with VIX at t+k
+RESAMPLE_REPLICATES = 100000  # Block bootstrap and block permutation replicates, each
+RESAMPLE_TASK_REPLICATES = 5000  # Replicates per pool task; fixed so results don't depend on worker count
+RESAMPLE_CHUNK = 500  # Replicates materialised as one index array at a time
+RESAMPLE_SEED = 20240301
+SETTLE_DAYS = 7  # Days behind the latest headline after which unscored rows no longer hold a day back
+
+def stage_seconds(stage):
+    """Timer histogram for one stage of the analysis, e.g. with stage_seconds('significance').time()."""
+    return metrics.histogram("analysis_stage_seconds", "Wall time per analysis stage and index", {"stage": stage})
+
+VALID_OUTPUT = "output GLOB '[0-9]*' AND output NOT GLOB '*[^0-9]*'"
 
 def fetch_headline_scores(batch_size=BATCH_SIZE):
     """Fetch headlines and their GPT output scores from the database in batches."""
     with sqlite3.connect(DB_PATH) as conn:
         cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM headlines")
-        total_rows = cursor.fetchone()[0]
-        batches = total_rows // batch_size + (1 if total_rows % batch_size > 0 else 0)
-        
-        for batch in range(batches):
-            query = f"SELECT ydm, output FROM headlines LIMIT {batch_size} OFFSET {batch * batch_size}"
-            cursor.execute(query)
+        last_id = 0
+        while True:
+            # Keyset pagination: each batch starts where the last one ended, unlike OFFSET
+            cursor.execute(
+                "SELECT id, ydm, output FROM headlines WHERE id > ? ORDER BY id LIMIT ?",
+                (last_id, batch_size),
+            )
             data = cursor.fetchall()
-            yield data
+            if not data:
+                break
+            last_id = data[-1][0]
+            yield [(date, output) for _, date, output in data]
 
 def adjust_and_aggregate_scores():
     """Adjust scores based on criteria and aggregate by day using batch processing."""
@@ -32,8 +61,8 @@ def adjust_and_aggregate_scores():
             try:
                 score = int(output)
                 adjusted_score = score - 50  # Adjusting score
-            except ValueError:
-                # If output is not an integer, ignore this record or log it as an error
+            except (TypeError, ValueError):
+                # If output is missing or not an integer, ignore this record or log it as an error
                 continue
 
             if date in daily_scores:
@@ -42,67 +71,589 @@ def adjust_and_aggregate_scores():
                 daily_scores[date] = adjusted_score
     return daily_scores
 
+DAILY_SCORES_SQL = f"""
+    SELECT ydm, SUM(CAST(output AS INTEGER) - 50), COUNT(*)
+    FROM headlines
+    WHERE {VALID_OUTPUT}
+    GROUP BY ydm
+    ORDER BY ydm
+"""
+
+TOPIC_SCORES_SQL = f"""
+    SELECT headlines.ydm, SUM(CAST(output AS INTEGER) - 50), COUNT(*)
+    FROM {FTS_TABLE} JOIN headlines ON headlines.id = {FTS_TABLE}.rowid
+    WHERE {FTS_TABLE} MATCH ? AND {VALID_OUTPUT}
+    GROUP BY headlines.ydm
+    ORDER BY headlines.ydm
+"""
+
+def query_daily_scores(db_path=None, topic=None):
+    """Sum adjusted scores (score - 50) per day inside SQLite; returns (ydm, score, count) rows in date order."""
+    with sqlite3.connect(db_path or DB_PATH) as conn:
+        if topic:
+            ensure_fts(conn)
+            return conn.execute(TOPIC_SCORES_SQL, (topic,)).fetchall()
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_headlines_ydm_output ON headlines (ydm, output)")
+        return conn.execute(DAILY_SCORES_SQL).fetchall()
+
+def aggregate_daily_scores(db_path=None, topic=None):
+    """Daily scores as a DataFrame with Date, Score and Count (valid headlines that day), sorted by Date."""
+    scores_df = pd.DataFrame(query_daily_scores(db_path, topic), columns=['Date', 'Score', 'Count'])
+    scores_df['Date'] = pd.to_datetime(scores_df['Date']).dt.date
+    return scores_df
+
+def score_columns(db_path=None, topic=None):
+    """Daily scores as Day (int64 day numbers), Score and Count arrays."""
+    rows = query_daily_scores(db_path, topic)
+    ydms, scores, counts = zip(*rows) if rows else ((), (), ())
+    return {
+        'Day': day_numbers(ydms),
+        'Score': np.array(scores, dtype=np.float64),
+        'Count': np.array(counts, dtype=np.int64),
+    }
+
+def index_columns(csv_path):
+    """Daily index data as a Day array plus one float64 array per numeric CSV column (Close, ...)."""
+    index_data = pd.read_csv(csv_path)
+    columns = {'Day': day_numbers(pd.to_datetime(index_data['Date']).values)}
+    for name in index_data.columns.drop('Date'):
+        if pd.api.types.is_numeric_dtype(index_data[name]):
+            columns[name] = index_data[name].to_numpy(dtype=np.float64)
+    return columns
+
+def load_score_columns(cache, db_path=None, topic=None):
+    """score_columns(), served from the column cache until the database or its WAL changes."""
+    db_path = db_path or DB_PATH
+    if cache is None:
+        return score_columns(db_path, topic)
+    kind = f'topic-{hashlib.sha1(topic.encode()).hexdigest()[:8]}' if topic else 'scores'
+    return cache.load(entry_key(kind, db_path), [db_path, f'{db_path}-wal'], lambda: score_columns(db_path, topic))
+
+def topic_slug(topic):
+    """File-name-safe form of a topic query, e.g. 'fed OR fomc' -> 'fed_or_fomc'."""
+    return re.sub(r'[^a-z0-9]+', '_', topic.lower()).strip('_')
+
+def load_index_columns(cache, csv_path):
+    """index_columns(), served from the column cache until the CSV changes."""
+    if cache is None:
+        return index_columns(csv_path)
+    return cache.load(entry_key('index', csv_path), [csv_path], lambda: index_columns(csv_path))
+
+def join_days(score_days, scores, index_days, closes):
+    """Inner-join two series on their int64 day numbers; returns Date, Score and Close sorted by day."""
+    days, score_at, index_at = np.intersect1d(score_days, index_days, return_indices=True)
+    return pd.DataFrame({
+        'Date': days.astype('datetime64[D]'),
+        'Score': np.asarray(scores)[score_at],
+        'Close': np.asarray(closes)[index_at],
+    })
+
+def read_index_data(csv_path):
+    """Read daily index data (Date and Close columns, as in a Yahoo Finance export) from CSV."""
+    index_data = pd.read_csv(csv_path)
+    index_data['Date'] = pd.to_datetime(index_data['Date']).dt.date
+    return index_data
+
 def read_vix_data():
     """Read VIX index data from CSV."""
-    vix_data = pd.read_csv(VIX_CSV_PATH)
-    vix_data['Date'] = pd.to_datetime(vix_data['Date']).dt.date
-    return vix_data
+    return read_index_data(VIX_CSV_PATH)
+
+def append_index_rows(csv_path, source):
+    """Append the rows of `source` (a CSV path or URL) dated after the last row of `csv_path`; returns how many were added."""
+    new_rows = pd.read_csv(source)
+    new_rows['Date'] = pd.to_datetime(new_rows['Date'])
+    if not Path(csv_path).exists():
+        new_rows.sort_values('Date').to_csv(csv_path, index=False, date_format='%Y-%m-%d')
+        return len(new_rows)
+    existing = pd.read_csv(csv_path)
+    new_rows = new_rows[new_rows['Date'] > pd.to_datetime(existing['Date']).max()].sort_values('Date')
+    if new_rows.empty:
+        return 0
+    with open(csv_path, 'rb') as f:
+        f.seek(-1, os.SEEK_END)
+        ends_with_newline = f.read(1) == b'\n'
+    with open(csv_path, 'a', newline='') as f:
+        if not ends_with_newline:
+            f.write('\n')
+        new_rows.reindex(columns=existing.columns).to_csv(f, header=False, index=False, date_format='%Y-%m-%d')
+    return len(new_rows)
+
+class SharedScores:
+    """The daily score series in one shared memory block: int64 day numbers, then float64 scores."""
+
+    def __init__(self, shm, length, owner):
+        self.shm = shm
+        self.length = length
+        self.owner = owner
+        self.days = np.ndarray((length,), dtype=np.int64, buffer=shm.buf)
+        self.scores = np.ndarray((length,), dtype=np.float64, buffer=shm.buf, offset=8 * length)
+
+    @classmethod
+    def create(cls, days, scores):
+        length = len(days)
+        shm = shared_memory.SharedMemory(create=True, size=max(16 * length, 1))
+        shared = cls(shm, length, owner=True)
+        shared.days[:] = days
+        shared.scores[:] = scores
+        return shared
+
+    @classmethod
+    def attach(cls, name, length):
+        return cls(shared_memory.SharedMemory(name=name), length, owner=False)
+
+    def close(self):
+        # Drop the array views first; the buffer can't be released while they exist
+        del self.days, self.scores
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+shared_scores = None
+column_cache = None
+
+def attach_shared_scores(name, length, cache_dir):
+    """Pool initializer: attach this worker process to the parent's score series and column cache."""
+    global shared_scores, column_cache
+    shared_scores = SharedScores.attach(name, length)
+    column_cache = ColumnCache(cache_dir) if cache_dir else None
 
 def correlate_data(daily_scores, vix_data):
-    """Correlate daily scores with VIX index data, ensuring only days with both scores and VIX data are included."""
-    scores_df = pd.DataFrame(list(daily_scores.items()), columns=['Date', 'Score'])
-    scores_df['Date'] = pd.to_datetime(scores_df['Date']).dt.date
+    """Correlate daily scores (the aggregate_daily_scores() DataFrame or a {date: score} dict) with index data, on days present in both."""
+    if isinstance(daily_scores, pd.DataFrame):
+        scores_df = daily_scores
+    else:
+        scores_df = pd.DataFrame(list(daily_scores.items()), columns=['Date', 'Score'])
+        scores_df['Date'] = pd.to_datetime(scores_df['Date']).dt.date
     
     # Merging on 'Date' to ensure only days with both scores and VIX data are included
     merged_data = pd.merge(vix_data, scores_df, on='Date', how='inner')
-    return merged_data
+    return merged_data.sort_values('Date', ignore_index=True)
+
+def lagged_rolling_correlations(scores, closes, windows=ROLLING_WINDOWS, lags=LAGS):
+    """Mean, Std, Min, Max and count of rolling score/close correlations for every (window, lag) pair."""
+    x = np.asarray(scores, dtype=float)
+    y = np.asarray(closes, dtype=float)
+    x = x - x.mean()
+    y = y - y.mean()
+    n = len(x)
+    records = []
+    for lag in lags:
+        if abs(lag) >= n:
+            a = b = x[:0]
+        else:
+            a, b = (x[:n - lag], y[lag:]) if lag >= 0 else (x[-lag:], y[:n + lag])
+        sums = np.zeros((5, len(a) + 1))
+        np.cumsum(np.stack((a, b, a * a, b * b, a * b)), axis=1, out=sums[:, 1:])
+        for window in windows:
+            if window > len(a):
+                records.append((window, lag, np.nan, np.nan, np.nan, np.nan, 0))
+                continue
+            sa, sb, saa, sbb, sab = sums[:, window:] - sums[:, :-window]
+            covariance = window * sab - sa * sb
+            variance = (window * saa - sa * sa) * (window * sbb - sb * sb)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                r = covariance / np.sqrt(variance)
+            r = np.clip(r[np.isfinite(r)], -1.0, 1.0)
+            if len(r) == 0:
+                records.append((window, lag, np.nan, np.nan, np.nan, np.nan, 0))
+                continue
+            records.append((window, lag, r.mean(), r.std(), r.min(), r.max(), len(r)))
+    return pd.DataFrame(records, columns=['Window', 'Lag', 'Mean', 'Std', 'Min', 'Max', 'Windows'])
+
+def generate_rolling_report(grid, name='VIX', slug=None):
+    """Write the (window x lag) grid as a CSV table."""
+    grid.to_csv(f'rolling_lag_correlation_{slug or name.lower()}.csv', index=False, float_format='%.4f')
+
+def rolling_heatmap_job(grid, name='VIX'):
+    """Figure job for a heatmap of the grid's mean rolling correlations by window and lag."""
+    heatmap = grid.pivot(index='Window', columns='Lag', values='Mean')
+    return ('heatmap', dict(
+        values=heatmap.values,
+        columns=list(heatmap.columns),
+        index=list(heatmap.index),
+        xlabel=f'Lag k ({name} at t+k vs. score at t)',
+        ylabel='Rolling window (days)',
+        title=f'Rolling Correlation of Daily Headline Scores and {name} Close by Window and Lag',
+        colorbar_label='Mean rolling correlation',
+    ), (12, 7))
+
+def moment_correlations(n, sx, sy, sxx, syy, sxy):
+    """Pearson correlation from sums over n pairs; arguments may be arrays of replicates."""
+    return (n * sxy - sx * sy) / np.sqrt((n * sxx - sx * sx) * (n * syy - sy * sy))
+
+def resample_correlations(x, y, method, block, replicates, seed):
+    """Correlations of `replicates` block bootstrap or block permutation resamples of (x, y), from one SeedSequence."""
+    rng = np.random.default_rng(seed)
+    n = len(x)
+    x = x - x.mean()
+    y = y - y.mean()
+    full_blocks, remainder = divmod(n, block)
+    if method == 'bootstrap':
+        # Sums of x, y, x^2, y^2 and xy over every moving block (and the short final block)
+        sums = np.zeros((5, n + 1))
+        np.cumsum(np.stack((x, y, x * x, y * y, x * y)), axis=1, out=sums[:, 1:])
+        block_sums = sums[:, block:] - sums[:, :-block]
+        tail_sums = sums[:, remainder:] - sums[:, :-remainder] if remainder else None
+    else:
+        # Cross products of every x block with every y block; the tail stays in place
+        x_blocks = x[:full_blocks * block].reshape(full_blocks, block)
+        y_blocks = y[:full_blocks * block].reshape(full_blocks, block)
+        cross = x_blocks @ y_blocks.T
+        tail_xy = x[full_blocks * block:] @ y[full_blocks * block:]
+        positions = np.arange(full_blocks)
+    correlations = []
+    for start in range(0, replicates, RESAMPLE_CHUNK):
+        size = min(RESAMPLE_CHUNK, replicates - start)
+        if method == 'bootstrap':
+            starts = rng.integers(0, n - block + 1, size=(size, math.ceil(n / block)))
+            totals = block_sums[:, starts[:, :full_blocks]].sum(axis=2)
+            if remainder:
+                totals += tail_sums[:, starts[:, -1]]
+            correlations.append(moment_correlations(n, *totals))
+        else:
+            order = np.argsort(rng.random((size, full_blocks)), axis=1)
+            sxy = cross[order, positions].sum(axis=1) + tail_xy
+            correlations.append(moment_correlations(n, 0.0, 0.0, x @ x, y @ y, sxy))
+    return np.concatenate(correlations)
+
+CORRELATION_STATE_SQL = """
+    CREATE TABLE IF NOT EXISTS correlation_state (
+        name TEXT PRIMARY KEY,
+        n INTEGER,
+        sx REAL,
+        sy REAL,
+        sxx REAL,
+        syy REAL,
+        sxy REAL,
+        last_date TEXT,
+        max_id INTEGER,
+        unscored INTEGER,
+        updated_at TEXT
+    )
+"""
+UPSERT_CORRELATION_STATE_SQL = """
+    INSERT INTO correlation_state (name, n, sx, sy, sxx, syy, sxy, last_date, max_id, unscored, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (name) DO UPDATE SET
+        n = excluded.n, sx = excluded.sx, sy = excluded.sy, sxx = excluded.sxx,
+        syy = excluded.syy, sxy = excluded.sxy, last_date = excluded.last_date,
+        max_id = excluded.max_id, unscored = excluded.unscored, updated_at = excluded.updated_at
+"""
+# The highest id and the unscored rows through a day: stored with the sums to notice later changes to folded days
+WATERMARK_SQL = """
+    SELECT (SELECT MAX(id) FROM headlines), (SELECT COUNT(*) FROM headlines WHERE output IS NULL AND ydm <= ?)
+"""
+SETTLED_SCORES_SQL = f"""
+    SELECT ydm, SUM(CAST(output AS INTEGER) - 50), COUNT(*)
+    FROM headlines
+    WHERE ydm > ? AND ydm <= ? AND {VALID_OUTPUT}
+    GROUP BY ydm
+    ORDER BY ydm
+"""
+STATE_SUMS = ('n', 'sx', 'sy', 'sxx', 'syy', 'sxy')
+
+def running_correlation(n, sx, sy, sxx, syy, sxy):
+    """Pearson r and its two-sided analytic p-value (as pearsonr gives them) from running sums."""
+    if n < 3:
+        return np.nan, np.nan
+    r = float(np.clip(moment_correlations(n, sx, sy, sxx, syy, sxy), -1.0, 1.0))
+    if abs(r) == 1.0:
+        return r, 0.0
+    t = r * math.sqrt((n - 2) / (1.0 - r * r))
+    return r, float(2 * student_t.sf(abs(t), n - 2))
+
+def update_running_correlation(csv_path, db_path=None, rebuild=False):
+    """Fold newly settled days into the running sums for one index; returns its summary row."""
+    db_path = db_path or DB_PATH
+    name = Path(csv_path).stem
+    index = index_columns(csv_path)
+    with sqlite3.connect(db_path) as conn:
+        conn.execute(CORRELATION_STATE_SQL)
+        if 'unscored' not in {column for _, column, *_ in conn.execute("PRAGMA table_info(correlation_state)")}:
+            # Sums stored without a watermark can't be checked, so they are recomputed
+            conn.execute("DROP TABLE correlation_state")
+            conn.execute(CORRELATION_STATE_SQL)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_headlines_ydm_output ON headlines (ydm, output)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_headlines_unscored ON headlines (ydm, id) WHERE output IS NULL")
+        state = conn.execute(
+            "SELECT n, sx, sy, sxx, syy, sxy, last_date, max_id, unscored FROM correlation_state WHERE name = ?",
+            (name,),
+        ).fetchone()
+        if state and not rebuild:
+            # A folded day gained rows (refetched) or had rows scored after it settled
+            inserted = conn.execute(
+                "SELECT EXISTS (SELECT 1 FROM headlines WHERE id > ? AND ydm <= ?)", (state[7] or 0, state[6])
+            ).fetchone()[0]
+            rebuild = bool(inserted) or conn.execute(WATERMARK_SQL, (state[6],)).fetchone()[1] != state[8]
+        if rebuild:
+            conn.execute("DELETE FROM correlation_state WHERE name = ?", (name,))
+            state = None
+        sums = dict(zip(STATE_SUMS, state[:6])) if state else dict.fromkeys(STATE_SUMS, 0)
+        last_date = state[6] if state else ''
+        latest, first_unscored = conn.execute(
+            "SELECT (SELECT MAX(ydm) FROM headlines), (SELECT MIN(ydm) FROM headlines WHERE output IS NULL AND ydm > ?)",
+            (last_date,),
+        ).fetchone()
+        added = 0
+        if latest is not None and len(index['Day']):
+            latest_day = day_numbers([latest])[0]
+            limits = [latest_day, index['Day'].max()]
+            if first_unscored is not None:
+                limits.append(max(day_numbers([first_unscored])[0] - 1, latest_day - SETTLE_DAYS))
+            cutoff = str(np.datetime64(int(min(limits)), 'D'))
+            if cutoff > last_date:
+                # Taken before the scores are read, so rows written meanwhile trigger a later rebuild
+                max_id, unscored = conn.execute(WATERMARK_SQL, (cutoff,)).fetchone()
+                rows = conn.execute(SETTLED_SCORES_SQL, (last_date, cutoff)).fetchall()
+                ydms, scores, _ = zip(*rows) if rows else ((), (), ())
+                joined = join_days(day_numbers(ydms), np.array(scores, dtype=np.float64), index['Day'], index['Close'])
+                x = joined['Score'].to_numpy(dtype=float)
+                y = joined['Close'].to_numpy(dtype=float)
+                for key, value in zip(STATE_SUMS, (len(x), x.sum(), y.sum(), x @ x, y @ y, x @ y)):
+                    sums[key] += value
+                added = len(x)
+                last_date = cutoff
+                with conn:
+                    conn.execute(
+                        UPSERT_CORRELATION_STATE_SQL,
+                        (
+                            name,
+                            *(sums[key] for key in STATE_SUMS),
+                            last_date,
+                            max_id,
+                            unscored,
+                            datetime.now().isoformat(timespec='seconds'),
+                        ),
+                    )
+    correlation_coef, p_value = running_correlation(*(sums[key] for key in STATE_SUMS))
+    return {
+        'Index': name,
+        'Days': int(sums['n']),
+        'Added': added,
+        'Correlation': correlation_coef,
+        'P-value': p_value,
+        'Through': last_date or None,
+    }
+
+def significance_tests(scores, closes, replicates=RESAMPLE_REPLICATES, block=None, workers=None, seed=RESAMPLE_SEED):
+    """Block bootstrap confidence interval and block permutation p-value for the score/VIX correlation."""
+    x = np.asarray(scores, dtype=float)
+    y = np.asarray(closes, dtype=float)
+    block = block or max(1, round(len(x) ** (1 / 3)))
+    observed = moment_correlations(len(x), x.sum(), y.sum(), x @ x, y @ y, x @ y)
+    tasks = [min(RESAMPLE_TASK_REPLICATES, replicates - start) for start in range(0, replicates, RESAMPLE_TASK_REPLICATES)]
+    seeds = np.random.SeedSequence(seed).spawn(2 * len(tasks))
+    bootstrap_args = zip(*[(x, y, 'bootstrap', block, count, seeds[i]) for i, count in enumerate(tasks)])
+    permutation_args = zip(*[(x, y, 'permutation', block, count, seeds[len(tasks) + i]) for i, count in enumerate(tasks)])
+    if workers == 1:
+        # Already inside a worker process (one per index): run the tasks here
+        bootstrap = np.concatenate(list(map(resample_correlations, *bootstrap_args)))
+        permutation = np.concatenate(list(map(resample_correlations, *permutation_args)))
+    else:
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+            bootstrap = pool.map(resample_correlations, *bootstrap_args)
+            permutation = pool.map(resample_correlations, *permutation_args)
+            bootstrap = np.concatenate(list(bootstrap))
+            permutation = np.concatenate(list(permutation))
+    bootstrap = bootstrap[np.isfinite(bootstrap)]
+    ci_low, ci_high = np.percentile(bootstrap, [2.5, 97.5])
+    exceed = np.count_nonzero(np.abs(permutation) >= abs(observed))
+    return {
+        'block': block,
+        'replicates': replicates,
+        'ci_low': ci_low,
+        'ci_high': ci_high,
+        'bootstrap_se': bootstrap.std(ddof=1),
+        'permutation_p': (exceed + 1) / (len(permutation) + 1),
+    }
+
+def significance_text(significance):
+    """Format significance_tests() results for the stats box and the PDF report."""
+    return (
+        f"Block bootstrap 95% CI: [{significance['ci_low']:.3f}, {significance['ci_high']:.3f}]"
+        f" (SE {significance['bootstrap_se']:.3f})\n"
+        f"Block permutation p-value: {significance['permutation_p']:.2e}"
+        f"\n({significance['replicates']:,} replicates, {significance['block']}-day blocks)"
+    )
+
+def generate_plots_and_reports(correlated_data, significance=None, name='VIX', grid=None, workers=None, hexbin_threshold=HEXBIN_THRESHOLD, slug=None):
+    """Generate scatter plot for daily scores vs. index Close data, including the correlation line, statistics, and hypothesis testing results."""
+    slug = slug or name.lower()
+    x = correlated_data['Score'].to_numpy(dtype=float)
+    y = correlated_data['Close'].to_numpy(dtype=float)
 
-def generate_plots_and_reports(correlated_data):
-    """Generate scatter plot for daily scores vs. VIX Close data, including the correlation line, statistics, and hypothesis testing results."""
-    plt.figure(figsize=(10, 6))
-    
-    # Generating a scatter plot
-    plt.scatter(correlated_data['Score'], correlated_data['Close'], color='blue', label='Data Points')
-    plt.xlabel('Daily Score')
-    plt.ylabel('VIX Close')
-    
     # Calculating the line of best fit
-    m, c = np.polyfit(correlated_data['Score'], correlated_data['Close'], 1)
-    
-    # Plotting the line of best fit
-    plt.plot(correlated_data['Score'], m*correlated_data['Score'] + c, 'r-', label=f'Fit Line: y={m:.2f}x+{c:.2f}')
-    
+    m, c = np.polyfit(x, y, 1)
+
     # Calculating Correlation Coefficient and p-value
-    correlation_coef, p_value = pearsonr(correlated_data['Score'], correlated_data['Close'])
-    
+    correlation_coef, p_value = pearsonr(x, y)
+
     # Calculating R^2 (Coefficient of Determination)
     r_squared = correlation_coef**2
-    
+
     # Adding text with the correlation coefficient, p-value, and R^2 value to the plot
     stats_text = f'Correlation Coefficient: {correlation_coef:.2f}\nP-value: {p_value:.3e}\nR^2: {r_squared:.2f}'
-    plt.text(0.05, 0.95, stats_text, transform=plt.gca().transAxes, fontsize=9, verticalalignment='top', bbox=dict(boxstyle='round', facecolor='wheat', alpha=0.5))
-    
-    plt.title('Daily Headline Scores vs. VIX Close')
-    plt.legend()
-    plt.tight_layout()
-    plt.savefig('scores_vs_vix_close_with_line_and_stats.png')
-    plt.close()
-    
+    if significance:
+        stats_text += f"\n{significance_text(significance)}"
+
+    jobs = [('scatter', dict(
+        x=x,
+        y=y,
+        xlabel='Daily Score',
+        ylabel=f'{name} Close',
+        title=f'Daily Headline Scores vs. {name} Close',
+        fit=(m, c),
+        stats_text=stats_text,
+        hexbin_threshold=hexbin_threshold,
+    ), (10, 6))]
+    if grid is not None:
+        jobs.append(rolling_heatmap_job(grid, name))
+    images = render_figures(jobs, workers)
+
+    scatter_png = images[0]
+    with open(f'scores_vs_{slug}_close_with_line_and_stats.png', 'wb') as f:
+        f.write(scatter_png)
+    lines = []
+    if significance:
+        lines.append(f"Pearson r = {correlation_coef:.4f}, analytic p = {p_value:.3e} (assumes independent days)")
+        lines.extend(significance_text(significance).splitlines())
+    pages = [(f"Daily Headline Scores vs. {name} Close Report with Correlation Line and Statistics", scatter_png, lines)]
+    if grid is not None:
+        with open(f'rolling_lag_correlation_heatmap_{slug}.png', 'wb') as f:
+            f.write(images[1])
+        pages.append((f"Rolling Correlation of Daily Headline Scores and {name} Close", images[1], []))
+
     # Create PDF report
-    pdf = FPDF()
-    pdf.add_page()
-    pdf.set_font("Arial", size=12)
-    pdf.cell(200, 10, txt="Daily Headline Scores vs. VIX Close Report with Correlation Line and Statistics", ln=True, align='C')
-    pdf.image('scores_vs_vix_close_with_line_and_stats.png', x=10, y=20, w=180)
-    pdf.output("report_scores_vs_vix_with_line_and_stats.pdf")
+    build_pdf(f"report_scores_vs_{slug}_with_line_and_stats.pdf", pages)
+    return correlation_coef, p_value
+
+def analyse_index(csv_path, replicates=RESAMPLE_REPLICATES, resample_workers=1, hexbin_threshold=HEXBIN_THRESHOLD, topic=None):
+    """Merge one index with the shared score series, write its reports and return its ranking row."""
+    name = Path(csv_path).stem
+    label, slug = name, name.lower()
+    if topic:
+        label, slug = f'{name} ({topic})', f'{slug}_{topic_slug(topic)}'
+    with stage_seconds('load_index').time():
+        index = load_index_columns(column_cache, csv_path)
+    with stage_seconds('join').time():
+        correlated_data = join_days(shared_scores.days, shared_scores.scores, index['Day'], index['Close'])
+    with stage_seconds('significance').time():
+        significance = significance_tests(correlated_data['Score'], correlated_data['Close'], replicates=replicates, workers=resample_workers)
+    with stage_seconds('rolling').time():
+        grid = lagged_rolling_correlations(correlated_data['Score'], correlated_data['Close'])
+        generate_rolling_report(grid, label, slug)
+    with stage_seconds('render').time():
+        correlation_coef, p_value = generate_plots_and_reports(correlated_data, significance, label, grid, resample_workers, hexbin_threshold, slug)
+    strongest = grid.loc[grid['Mean'].abs().idxmax()] if grid['Mean'].notna().any() else None
+    row = {'Topic': topic} if topic else {}
+    return {
+        **row,
+        'Index': name,
+        'Days': len(correlated_data),
+        'Correlation': correlation_coef,
+        'P-value': p_value,
+        'CI Low': significance['ci_low'],
+        'CI High': significance['ci_high'],
+        'Permutation P': significance['permutation_p'],
+        'Strongest Window': strongest['Window'] if strongest is not None else np.nan,
+        'Strongest Lag': strongest['Lag'] if strongest is not None else np.nan,
+        'Strongest Mean': strongest['Mean'] if strongest is not None else np.nan,
+    }
+
+def analyse_index_in_worker(*args):
+    """analyse_index() in a pool worker; also returns the metrics it recorded, for the parent to merge."""
+    metrics.REGISTRY.reset()
+    return analyse_index(*args), metrics.REGISTRY.snapshot()
+
+def correlate_indices(csv_paths, workers=None, replicates=RESAMPLE_REPLICATES, cache_dir=COLUMN_CACHE_DIR, hexbin_threshold=HEXBIN_THRESHOLD, topic=None):
+    """Ranking rows for every index CSV against one score series (all headlines, or those matching `topic`)."""
+    global shared_scores, column_cache
+    column_cache = ColumnCache(cache_dir) if cache_dir else None
+    with stage_seconds('load_scores').time():
+        columns = load_score_columns(column_cache, topic=topic)
+    if len(columns['Day']) < 3:
+        column_cache = None
+        print(f"Skipping topic {topic!r}: only {len(columns['Day'])} days have matching scored headlines.")
+        return []
+    scores = SharedScores.create(columns['Day'], columns['Score'])
+    try:
+        if len(csv_paths) == 1:
+            shared_scores = scores
+            rows = [analyse_index(csv_paths[0], replicates, workers, hexbin_threshold, topic)]
+        else:
+            with ProcessPoolExecutor(
+                max_workers=workers or min(len(csv_paths), os.cpu_count()),
+                initializer=attach_shared_scores,
+                initargs=(scores.shm.name, scores.length, cache_dir),
+            ) as pool:
+                count = len(csv_paths)
+                rows = []
+                for row, snapshot in pool.map(analyse_index_in_worker, csv_paths, [replicates] * count, [1] * count, [hexbin_threshold] * count, [topic] * count):
+                    rows.append(row)
+                    metrics.REGISTRY.merge(snapshot)
+    finally:
+        shared_scores = None
+        column_cache = None
+        scores.close()
+    return rows
+
+def run_indices(csv_paths, workers=None, replicates=RESAMPLE_REPLICATES, cache_dir=COLUMN_CACHE_DIR, hexbin_threshold=HEXBIN_THRESHOLD, topics=None):
+    """Correlate the score series of every topic (or of all headlines) with every index CSV and write the ranking table."""
+    rows = []
+    for topic in topics or [None]:
+        rows.extend(correlate_indices(csv_paths, workers, replicates, cache_dir, hexbin_threshold, topic))
+
+    ranking = pd.DataFrame(rows)
+    if ranking.empty:
+        return ranking
+    ranking = ranking.iloc[ranking['Correlation'].abs().argsort()[::-1]].reset_index(drop=True)
+    ranking.index += 1
+    ranking.to_csv(RANKING_CSV_PATH, index_label='Rank', float_format='%.6g')
+    return ranking
 
 def main():
-    adjusted_daily_scores = adjust_and_aggregate_scores()
-    vix_data = read_vix_data()
-    correlated_data = correlate_data(adjusted_daily_scores, vix_data)
-    generate_plots_and_reports(correlated_data)
+    run_indices([VIX_CSV_PATH])
 
     print("Correlation analysis and report have been generated.")
 
+parser = argparse.ArgumentParser(description="Correlate daily headline scores with one or more market indices.")
+parser.add_argument("indices", nargs="*", default=[VIX_CSV_PATH], help="index CSVs with Date and Close columns, named by file stem (default: %(default)s)")
+parser.add_argument("-w", "--workers", type=int, help="worker processes (default: one per index, up to the CPU count)")
+parser.add_argument("--replicates", type=int, default=RESAMPLE_REPLICATES, help="bootstrap and permutation replicates per index (default: %(default)s)")
+parser.add_argument("--cache-dir", default=COLUMN_CACHE_DIR, help="columnar cache of daily scores and index data (default: %(default)s)")
+parser.add_argument("--no-cache", action="store_true", help="re-read the database and CSVs without caching")
+parser.add_argument("--metrics", metavar="PATH", help="export per-stage timings here (.prom/.txt: Prometheus text, else JSON)")
+parser.add_argument("-t", "--topic", action="append", dest="topics", metavar="QUERY", help="only count headlines matching this FTS5 query, e.g. 'fed OR fomc'; repeat for one run per topic")
+parser.add_argument("--incremental", action="store_true", help="only fold newly settled days into each index's running correlation sums (no reports)")
+parser.add_argument("--rebuild", action="store_true", help="with --incremental, recompute the running sums from the whole history")
+parser.add_argument("--hexbin-threshold", type=int, default=HEXBIN_THRESHOLD, help="draw scatter plots with more points than this as hexbin densities; 0 never does (default: %(default)s)")
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    args = parser.parse_args()
+    if args.incremental and args.topics:
+        parser.error("--incremental keeps running sums over all headlines; it can't be combined with --topic")
+    if args.topics:
+        with sqlite3.connect(DB_PATH) as conn:
+            ensure_fts(conn)
+            for topic in args.topics:
+                error = query_error(conn, topic)
+                if error:
+                    parser.error(f"invalid --topic {topic!r} ({error}); put terms with punctuation in double quotes, e.g. '\"S&P\"'")
+    exporter = metrics.start_export(args.metrics)
+    try:
+        if args.incremental:
+            with stage_seconds('incremental').time():
+                updates = pd.DataFrame([update_running_correlation(path, rebuild=args.rebuild) for path in args.indices])
+        else:
+            ranking = run_indices(args.indices, args.workers, args.replicates, None if args.no_cache else args.cache_dir, args.hexbin_threshold, args.topics)
+    finally:
+        if exporter is not None:
+            exporter.stop()
+    if args.incremental:
+        print(updates.to_string(index=False, float_format=lambda value: f"{value:.4g}"))
+        print("Running correlations have been updated.")
+    elif ranking.empty:
+        print("No topic matched enough scored days; no reports were generated.")
+    else:
+        print(ranking.to_string(float_format=lambda value: f"{value:.4g}"))
+        print("Correlation analysis and report have been generated.")
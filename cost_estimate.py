@@ -0,0 +1,112 @@
+"""Exact token and cost estimates for scoring a whole headlines database.
+
+Every prompt is a fixed per-month prefix followed by the headline, so the
+prefix is tokenized once per (year, month) and only the headline part is
+tokenized per row. Headlines are tokenized in chunks on a process pool, each
+worker loading the encoder once; databases under POOL_MIN_ROWS rows are
+tokenized in-process, where starting the pool would cost more than it saves.
+
+Splitting is exact because the prompt prefix ends in ": " and tiktoken's
+pre-tokenizer never merges across a punctuation mark and the space that
+follows it: ": <headline>" is always tokenized as ":" plus " <headline>".
+"""
+import os
+import sqlite3
+from concurrent.futures import FIRST_COMPLETED, wait
+from functools import lru_cache
+
+TOKENS_PER_MESSAGE = 3
+TOKENS_REPLY_PRIMER = 3  # every reply is primed with <|start|>assistant<|message|>
+CHUNK_ROWS = 20000
+POOL_MIN_ROWS = 200000  # Fewer rows are tokenized in-process
+
+worker_encoding = None
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model):
+    import tiktoken  # Only the paths that count tokens pay for the import
+
+    try:
+        return tiktoken.encoding_for_model(model)
+    except (KeyError, ValueError):
+        print("Warning: model not found. Using cl100k_base encoding.")
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def init_worker(model):
+    global worker_encoding
+    worker_encoding = get_encoding(model)
+
+
+def count_chunk(texts):
+    return sum(len(tokens) for tokens in worker_encoding.encode_ordinary_batch(texts, num_threads=1))
+
+
+def split_prefix(prefix):
+    """Move a trailing space of the prompt prefix over to the headline part."""
+    if prefix.endswith(" "):
+        return prefix[:-1], " "
+    return prefix, ""
+
+
+def count_headline_tokens(db, model, headline_lead, workers):
+    """Sum the tokens of `headline_lead + headline` over every row, on a process pool unless `workers` is 1."""
+    from concurrent.futures import ProcessPoolExecutor
+
+    total = 0
+    if workers == 1:
+        init_worker(model)
+        with sqlite3.connect(db) as conn:
+            cursor = conn.execute("SELECT headline FROM headlines")
+            while True:
+                rows = cursor.fetchmany(CHUNK_ROWS)
+                if not rows:
+                    break
+                total += count_chunk([headline_lead + (headline or "") for (headline,) in rows])
+        return total
+    with sqlite3.connect(db) as conn, ProcessPoolExecutor(
+        max_workers=workers, initializer=init_worker, initargs=(model,)
+    ) as executor:
+        cursor = conn.execute("SELECT headline FROM headlines")
+        pending = set()
+        while True:
+            while len(pending) < workers * 2:
+                rows = cursor.fetchmany(CHUNK_ROWS)
+                if not rows:
+                    break
+                texts = [headline_lead + (headline or "") for (headline,) in rows]
+                pending.add(executor.submit(count_chunk, texts))
+            if not pending:
+                break
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            total += sum(future.result() for future in finished)
+    return total
+
+
+def estimate_db_tokens(db, model, prompt_prefix, output_text, role="system", workers=None):
+    """Return (rows, input_tokens, output_tokens) for one single-message prompt per row.
+
+    `prompt_prefix(year, month)` is the rendered prompt up to where the
+    headline is appended; `output_text` is the expected answer per row.
+    """
+    encoding = get_encoding(model)
+    workers = workers or os.cpu_count() or 1
+    per_row = TOKENS_PER_MESSAGE + len(encoding.encode(role)) + TOKENS_REPLY_PRIMER
+    output_per_row = len(encoding.encode(output_text))
+
+    with sqlite3.connect(db) as conn:
+        months = conn.execute(
+            "SELECT strftime('%Y', ydm), strftime('%m', ydm), COUNT(*) FROM headlines GROUP BY 1, 2"
+        ).fetchall()
+    rows = 0
+    input_tokens = 0
+    headline_lead = ""
+    for year, month, count in months:
+        prefix, headline_lead = split_prefix(prompt_prefix(year, month))
+        input_tokens += count * (per_row + len(encoding.encode(prefix)))
+        rows += count
+    if rows < POOL_MIN_ROWS:
+        workers = 1
+    input_tokens += count_headline_tokens(db, model, headline_lead, workers)
+    return rows, input_tokens, rows * output_per_row
@@ -0,0 +1,108 @@
+"""Nightly run of the whole pipeline over the days added since the last run.
+
+    python daily.py --index VIX.csv --index-source https://example.com/VIX_History.csv
+
+1. scrape: days that failed on earlier runs, then the archive days after
+   the latest one in the database, through yesterday
+   (`headlines.py --incremental`)
+2. score: unscored rows of the last SETTLE_DAYS days, the new ones and any
+   refetched ones (`chatgpt.py --since`), so rows that failed on a previous
+   night get another try while the running correlation still waits for them
+3. index: rows of `--index-source` newer than the index CSV's last row are
+   appended to it
+4. correlate: newly settled days are folded into the running correlation sums
+   (`correlation_analysis.py --incremental`), which are rebuilt when an
+   earlier day was refetched or had rows scored after it settled
+
+Every step reads and writes only what is new, so a night costs the new days
+rather than the whole history. Run the full correlation_analysis.py for
+reports, plots and resampling tests.
+"""
+import argparse
+import time
+from datetime import timedelta
+
+import headlines
+import metrics
+from chatgpt import GPT_ENDPOINT, GPT_REQUESTS_PER_MINUTE, GPT_TOKENS_PER_MINUTE, Scorer, ScorerConfig
+from correlation_analysis import SETTLE_DAYS, VIX_CSV_PATH, append_index_rows, update_running_correlation
+
+
+def scrape(args):
+    argv = ["--incremental", "--base-url", args.base_url, "--workers", str(args.scrape_workers)]
+    argv += ["--delay", str(args.delay)]
+    if args.no_cache:
+        argv.append("--no-cache")
+    headlines.main(headlines.parser.parse_args(argv))
+
+
+def run_daily(args):
+    """Scrape, score, extend the index and update the running correlation; returns seconds per step."""
+    timings = {}
+    start = time.perf_counter()
+
+    headlines.create_table()
+    latest = headlines.latest_date()
+    gaps = headlines.missing_dates()
+    scrape(args)
+    still_missing = set(headlines.missing_dates())
+    refetched = [date for date in gaps if date not in still_missing]
+    timings["scrape"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    since = None
+    if latest is not None:
+        since = min([latest + timedelta(days=1 - SETTLE_DAYS), *refetched]).strftime("%Y-%m-%d")
+    config = ScorerConfig(
+        endpoint=args.endpoint,
+        requests_per_minute=args.requests_per_minute,
+        tokens_per_minute=args.tokens_per_minute,
+    )
+    Scorer(config).score(args.workers, args.batch_size, since=since)
+    timings["score"] = time.perf_counter() - start
+
+    if args.index_source:
+        start = time.perf_counter()
+        added = append_index_rows(args.index, args.index_source)
+        print(f"\n{args.index}: {added} index rows appended")
+        timings["index"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    # Refetched or late-scored days older than the sums' last day get them recomputed
+    update = update_running_correlation(args.index)
+    print(
+        f"{update['Index']}: r={update['Correlation']:.4g} p={update['P-value']:.4g} "
+        f"over {update['Days']} days through {update['Through']} ({update['Added']} added)"
+    )
+    timings["correlate"] = time.perf_counter() - start
+    return timings
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--index", default=VIX_CSV_PATH, help="Index CSV the running correlation is kept for")
+parser.add_argument("--index-source", help="CSV path or URL of the index's history to append new rows from")
+parser.add_argument("--base-url", default=headlines.ARCHIVE_URL, help="Archive root, e.g. a local stub server")
+parser.add_argument("--scrape-workers", type=int, default=headlines.CRAWL_WORKERS, help="Days fetched concurrently")
+parser.add_argument("--delay", type=float, default=headlines.CRAWL_HOST_DELAY, help="Minimum seconds between requests to the same host")
+parser.add_argument("--no-cache", action="store_true", help="Neither read nor write the page cache")
+parser.add_argument("-w", "--workers", type=int, default=8, help="Scoring requests in flight")
+parser.add_argument("-b", "--batch-size", type=int, default=1, help="Headlines scored per request")
+parser.add_argument("--endpoint", default=GPT_ENDPOINT)
+parser.add_argument("--requests-per-minute", type=int, default=GPT_REQUESTS_PER_MINUTE)
+parser.add_argument("--tokens-per-minute", type=int, default=GPT_TOKENS_PER_MINUTE)
+parser.add_argument(
+    "--metrics",
+    metavar="PATH",
+    help="Export timings and counters of every step here (.prom/.txt: Prometheus text, else JSON)",
+)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    exporter = metrics.start_export(args.metrics)
+    try:
+        timings = run_daily(args)
+    finally:
+        if exporter is not None:
+            exporter.stop()
+    print(" ".join(f"{step} {seconds:.1f}s" for step, seconds in timings.items()))
@@ -0,0 +1,94 @@
+"""Headline extractors for WSJ archive pages.
+
+Every extractor takes the page HTML as a string and returns the headline texts
+in page order. `lxml` is the fast path and is used by default when it is
+installed; `stream` is a stdlib incremental parser that only tracks headline
+spans; `bs4` is the original BeautifulSoup extractor, kept as the fallback.
+"""
+from html.parser import HTMLParser
+
+from bs4 import BeautifulSoup
+
+try:
+    import lxml.html
+except ImportError:  # lxml is optional, the stdlib/bs4 paths still work
+    lxml = None
+
+HEADLINE_CLASS = "WSJTheme--headlineText"
+HEADLINE_XPATH = f"//span[contains(@class, '{HEADLINE_CLASS}')]"
+
+
+def extract_bs4(html):
+    soup = BeautifulSoup(html, "html.parser")
+    return [
+        headline.get_text()
+        for headline in soup.find_all(
+            "span", {"class": lambda x: x and HEADLINE_CLASS in x}
+        )
+    ]
+
+
+def extract_lxml(html):
+    if not html.strip():
+        return []
+    root = lxml.html.fromstring(html)
+    return [span.text_content() for span in root.xpath(HEADLINE_XPATH)]
+
+
+class HeadlineParser(HTMLParser):
+    """Collects the text of headline spans without building a document tree."""
+
+    def __init__(self):
+        super().__init__()
+        self.headlines = []
+        self.parts = None
+        self.depth = 0  # Open <span> tags inside the current headline
+
+    def handle_starttag(self, tag, attrs):
+        if tag != "span":
+            return
+        if self.parts is not None:
+            self.depth += 1
+            return
+        for name, value in attrs:
+            if name == "class" and value and HEADLINE_CLASS in value:
+                self.parts = []
+                self.depth = 0
+                return
+
+    def handle_endtag(self, tag):
+        if tag != "span" or self.parts is None:
+            return
+        if self.depth:
+            self.depth -= 1
+            return
+        self.headlines.append("".join(self.parts))
+        self.parts = None
+
+    def handle_data(self, data):
+        if self.parts is not None:
+            self.parts.append(data)
+
+
+def extract_stream(html):
+    parser = HeadlineParser()
+    parser.feed(html)
+    parser.close()
+    if parser.parts is not None:  # Page cut off inside a headline
+        parser.headlines.append("".join(parser.parts))
+    return parser.headlines
+
+
+EXTRACTORS = {"bs4": extract_bs4, "stream": extract_stream}
+if lxml is not None:
+    EXTRACTORS["lxml"] = extract_lxml
+DEFAULT_EXTRACTOR = "lxml" if lxml is not None else "bs4"
+
+
+def get_extractor(name=None):
+    name = name or DEFAULT_EXTRACTOR
+    if name not in EXTRACTORS:
+        raise ValueError(
+            f"Unknown extractor '{name}', available: {', '.join(sorted(EXTRACTORS))}"
+        )
+    return EXTRACTORS[name]
@@ -0,0 +1,56 @@
+"""SQLite FTS5 full-text index over `headlines.headline`.
+
+`headlines_fts` is an external-content table: it holds only the index and
+reads headline text from `headlines` by rowid, so the text isn't stored
+twice. Triggers keep it in step with inserted, deleted and edited headlines.
+The update trigger only fires on the headline column, so writing scores to
+`output` never touches the index. Topic queries use FTS5 syntax, with porter
+stemming, e.g. `fed OR fomc`, `oil NOT olive`, `"interest rate"` or `earn*`.
+"""
+import sqlite3
+
+FTS_TABLE = "headlines_fts"
+FTS_SCHEMA = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        headline, content='headlines', content_rowid='id', tokenize='porter unicode61'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS headlines_fts_insert AFTER INSERT ON headlines BEGIN
+        INSERT INTO {FTS_TABLE} (rowid, headline) VALUES (new.id, new.headline);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS headlines_fts_delete AFTER DELETE ON headlines BEGIN
+        INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, headline) VALUES ('delete', old.id, old.headline);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS headlines_fts_update AFTER UPDATE OF headline ON headlines BEGIN
+        INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, headline) VALUES ('delete', old.id, old.headline);
+        INSERT INTO {FTS_TABLE} (rowid, headline) VALUES (new.id, new.headline);
+    END
+    """,
+]
+
+
+def ensure_fts(conn):
+    """Create the index and its triggers if missing, indexing the rows already in the table once."""
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (FTS_TABLE,)
+    ).fetchone()
+    for sql in FTS_SCHEMA:
+        conn.execute(sql)
+    if exists is None:
+        conn.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('rebuild')")
+    conn.commit()
+
+
+def query_error(conn, query):
+    """The FTS5 error message for `query`, or None when it parses."""
+    try:
+        conn.execute(f"SELECT 1 FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH ? LIMIT 1", (query,)).fetchall()
+    except sqlite3.OperationalError as e:
+        return str(e)
+    return None
@@ -1,9 +1,188 @@
+import argparse
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
 import sqlite3
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from itertools import chain
+from urllib.parse import urlsplit
+
+import metrics
+from extractors import DEFAULT_EXTRACTOR, EXTRACTORS, get_extractor
+from headline_index import ensure_fts
+from page_cache import CACHE_DIR, CACHE_MAX_BYTES, PageCache
 
 DB = "headlines.db"
+ARCHIVE_URL = "https://www.wsj.com/news/archive"
+CRAWL_WORKERS = 8  # Days fetched at the same time
+CRAWL_POOL_SIZE = 8  # Keep-alive connections kept open per host
+CRAWL_HOST_DELAY = 0.1  # Minimum seconds between two requests to the same host
+FETCH_ATTEMPTS = 5  # Tries per archive page before its day is given up for this run
+FETCH_BACKOFF = 1.0  # Seconds before the first retry, doubled after each failure
+FETCH_MAX_BACKOFF = 60.0
+WRITER_BATCH_ROWS = 5000  # Headlines committed per writer transaction
+WRITER_FLUSH_SECONDS = 5.0  # Commit at least this often while crawling
+WRITER_QUEUE_DAYS = 256  # Fetched days that may wait for the writer
+WRITER_PRAGMAS = (
+    "journal_mode=WAL",
+    "synchronous=NORMAL",  # WAL stays consistent; only the last commits can be lost
+    "temp_store=MEMORY",
+    "cache_size=-65536",  # 64 MiB page cache
+    "busy_timeout=30000",
+)
+HEADERS = {
+    "authority": "www.wsj.com",
+    "accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7",
+    "accept-language": "pt-BR,pt;q=0.9,en-US;q=0.8,en;q=0.7",
+    "cache-control": "max-age=0",
+    "cookie": "",
+    "sec-ch-ua": '"Chromium";v="122", "Not(A:Brand";v="24", "Google Chrome";v="122"',
+    "sec-ch-ua-mobile": "?0",
+    "sec-ch-ua-platform": '"Windows"',
+    "sec-fetch-dest": "document",
+    "sec-fetch-mode": "navigate",
+    "sec-fetch-site": "none",
+    "sec-fetch-user": "?1",
+    "upgrade-insecure-requests": "1",
+    "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36",
+}
+
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "--start",
+    type=lambda s: datetime.strptime(s, "%Y-%m-%d"),
+    default=datetime(1998, 1, 1),
+    help="First archive day to fetch (YYYY-MM-DD)",
+)
+parser.add_argument(
+    "--end",
+    type=lambda s: datetime.strptime(s, "%Y-%m-%d"),
+    help="Last archive day to fetch (YYYY-MM-DD; default 2023-12-31, or yesterday with --incremental)",
+)
+parser.add_argument(
+    "--incremental",
+    action="store_true",
+    help="Start the day after the latest day already in the database, after retrying days missing from crawl_state",
+)
+parser.add_argument(
+    "-w", "--workers", type=int, default=CRAWL_WORKERS, help="Days fetched concurrently"
+)
+parser.add_argument(
+    "--pool-size",
+    type=int,
+    default=CRAWL_POOL_SIZE,
+    help="Keep-alive connections per host",
+)
+parser.add_argument(
+    "--delay",
+    type=float,
+    default=CRAWL_HOST_DELAY,
+    help="Minimum seconds between requests to the same host",
+)
+parser.add_argument(
+    "--resume",
+    action="store_true",
+    help="Skip days already recorded as complete in crawl_state",
+)
+parser.add_argument(
+    "--extractor",
+    choices=sorted(EXTRACTORS),
+    default=DEFAULT_EXTRACTOR,
+    help="Headline extractor used on archive pages",
+)
+parser.add_argument(
+    "--batch-rows",
+    type=int,
+    default=WRITER_BATCH_ROWS,
+    help="Headlines committed per SQLite transaction",
+)
+parser.add_argument(
+    "--flush-seconds",
+    type=float,
+    default=WRITER_FLUSH_SECONDS,
+    help="Commit pending headlines at least this often",
+)
+parser.add_argument(
+    "--cache-dir", default=CACHE_DIR, help="Directory of the raw page cache"
+)
+parser.add_argument(
+    "--cache-max-mb",
+    type=float,
+    default=CACHE_MAX_BYTES / 1024**2,
+    help="Evict least recently used pages beyond this cache size",
+)
+parser.add_argument(
+    "--no-cache", action="store_true", help="Neither read nor write the page cache"
+)
+parser.add_argument(
+    "--replay",
+    action="store_true",
+    help="Re-extract headlines from the page cache only, without network access",
+)
+parser.add_argument(
+    "--base-url", default=ARCHIVE_URL, help="Archive root, e.g. a local stub server"
+)
+parser.add_argument(
+    "--metrics",
+    metavar="PATH",
+    help="Export timings and counters here (.prom/.txt: Prometheus text, else JSON)",
+)
+parser.add_argument(
+    "--metrics-interval",
+    type=float,
+    default=metrics.EXPORT_SECONDS,
+    help="Seconds between metrics exports",
+)
+
+
+FETCH_SECONDS = metrics.histogram("scrape_fetch_seconds", "HTTP fetch latency per archive page")
+PARSE_SECONDS = metrics.histogram("scrape_parse_seconds", "Headline extraction time per page")
+WRITE_SECONDS = metrics.histogram("scrape_write_seconds", "SQLite transaction time per writer flush")
+PACER_WAIT_SECONDS = metrics.histogram("scrape_pacer_wait_seconds", "Sleep imposed by the per-host delay")
+NETWORK_PAGES = metrics.counter("scrape_pages_total", "Archive pages processed", {"source": "network"})
+CACHED_PAGES = metrics.counter("scrape_pages_total", "Archive pages processed", {"source": "cache"})
+HEADLINES_FOUND = metrics.counter("scrape_headlines_total", "Headlines extracted")
+ROWS_WRITTEN = metrics.counter("scrape_rows_written_total", "Headline rows sent to SQLite")
+FETCH_RETRIES = metrics.counter("scrape_fetch_retries_total", "Archive page requests retried after an error status")
+FAILED_DAYS = metrics.counter("scrape_failed_days_total", "Days given up after FETCH_ATTEMPTS failures on one page")
+
+
+class HostPacer:
+    """Keeps requests to the same host at least `delay` seconds apart across threads."""
+
+    def __init__(self, delay=CRAWL_HOST_DELAY):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.next_slot = {}
+
+    def wait(self, url):
+        if self.delay <= 0:
+            return
+        host = urlsplit(url).netloc
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.delay
+        if slot > now:
+            PACER_WAIT_SECONDS.observe(slot - now)
+            time.sleep(slot - now)
+
+
+def make_session(pool_size=CRAWL_POOL_SIZE):
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    # pool_block caps the open connections per host at pool_size, so extra
+    # workers wait for a free keep-alive connection instead of opening new ones
+    adapter = HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size, pool_block=True
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
 
 
 def create_table():
@@ -19,70 +198,369 @@ def create_table():
             )
         """
         )
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS crawl_state (
+                ydm DATE PRIMARY KEY,
+                pages INTEGER,
+                headlines INTEGER,
+                completed_at TEXT
+            )
+        """
+        )
+        cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_headlines_headline_ydm'"
+        )
+        if cursor.fetchone() is None:
+            # Databases from restarted runs hold duplicate rows; keep one copy
+            # per (headline, ydm), preferring a scored one, before adding the key
+            cursor.execute(
+                """
+                DELETE FROM headlines WHERE id NOT IN (
+                    SELECT id FROM (
+                        SELECT id, ROW_NUMBER() OVER (
+                            PARTITION BY headline, ydm ORDER BY output IS NULL, id
+                        ) AS rn
+                        FROM headlines
+                    ) WHERE rn = 1
+                )
+            """
+            )
+            cursor.execute(
+                "CREATE UNIQUE INDEX idx_headlines_headline_ydm ON headlines (headline, ydm)"
+            )
+        # Full-text index for topic-filtered analysis, built once for existing databases
+        ensure_fts(conn)
+
+
+def latest_date():
+    """The latest day with headlines or a completed crawl, or None for an empty database."""
+    with sqlite3.connect(DB) as conn:
+        latest = conn.execute(
+            "SELECT MAX(ydm) FROM (SELECT MAX(ydm) AS ydm FROM headlines UNION ALL SELECT MAX(ydm) FROM crawl_state)"
+        ).fetchone()[0]
+    return datetime.strptime(latest, "%Y-%m-%d") if latest else None
+
+
+def completed_dates():
+    with sqlite3.connect(DB) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT ydm FROM crawl_state")
+        return {row[0] for row in cursor.fetchall()}
+
+
+def missing_dates():
+    """Days between the first and last crawl_state days that aren't recorded as complete."""
+    done = completed_dates()
+    if not done:
+        return []
+    first, last = (datetime.strptime(ydm, "%Y-%m-%d") for ydm in (min(done), max(done)))
+    return [date for date in daterange(first, last) if date.strftime("%Y-%m-%d") not in done]
+
+
+INSERT_HEADLINE_SQL = "INSERT INTO headlines (headline, ydm) VALUES (?, ?) ON CONFLICT (headline, ydm) DO NOTHING"
+UPSERT_CRAWL_STATE_SQL = """
+    INSERT INTO crawl_state (ydm, pages, headlines, completed_at) VALUES (?, ?, ?, ?)
+    ON CONFLICT (ydm) DO UPDATE SET
+        pages = excluded.pages,
+        headlines = excluded.headlines,
+        completed_at = excluded.completed_at
+"""
 
 
-def insert_data(headlines, date):
+def crawl_state_row(headlines, date, pages):
+    return (date, pages, len(headlines), datetime.now().isoformat(timespec="seconds"))
+
+
+def insert_data(headlines, date, pages=None):
     print(date)
     with sqlite3.connect(DB) as conn:
         cursor = conn.cursor()
         cursor.executemany(
-            "INSERT INTO headlines (headline, ydm) VALUES (?, ?)",
-            [(headline, date) for headline in headlines],
+            INSERT_HEADLINE_SQL, [(headline, date) for headline in headlines]
+        )
+        # Same transaction as the rows, so a day is never marked done without them
+        cursor.execute(UPSERT_CRAWL_STATE_SQL, crawl_state_row(headlines, date, pages))
+
+
+class HeadlineWriter:
+    """Writes crawled days to DB from a dedicated thread over one connection.
+
+    Days queued with put() are buffered and committed together once
+    `batch_rows` headlines are pending or `flush_interval` seconds have passed,
+    so fetch threads never wait on SQLite commits. A day's crawl_state row is
+    committed in the same transaction as its headlines.
+    """
+
+    def __init__(
+        self,
+        db=None,
+        batch_rows=WRITER_BATCH_ROWS,
+        flush_interval=WRITER_FLUSH_SECONDS,
+        queue_days=WRITER_QUEUE_DAYS,
+    ):
+        self.db = db or DB
+        self.batch_rows = batch_rows
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=queue_days)
+        self.thread = threading.Thread(target=self.run, name="headline-writer", daemon=True)
+        self.error = None
+        self.rows_written = 0
+        self.days_written = 0
+        self.transactions = 0
+        self.write_seconds = 0.0
+        self.started_at = None
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self.thread.start()
+        return self
+
+    def put(self, headlines, date, pages=None):
+        if self.error is not None:
+            raise RuntimeError("Headline writer stopped") from self.error
+        self.queue.put((headlines, date, pages))
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise RuntimeError("Headline writer stopped") from self.error
+
+    def run(self):
+        conn = None
+        closed = False
+        try:
+            conn = sqlite3.connect(self.db)
+            for pragma in WRITER_PRAGMAS:
+                conn.execute(f"PRAGMA {pragma}")
+            buffer = []
+            pending_rows = 0
+            last_flush = time.monotonic()
+            while True:
+                try:
+                    item = self.queue.get(timeout=self.flush_interval)
+                except queue.Empty:
+                    item = False
+                closed = item is None
+                if item:
+                    buffer.append(item)
+                    pending_rows += len(item[0])
+                due = time.monotonic() - last_flush >= self.flush_interval
+                if buffer and (item is None or pending_rows >= self.batch_rows or due):
+                    self.flush(conn, buffer)
+                    buffer = []
+                    pending_rows = 0
+                    last_flush = time.monotonic()
+                if item is None:
+                    break
+        except Exception as e:
+            self.error = e
+            # Keep draining so producers blocked on a full queue can finish,
+            # unless close() has already sent the sentinel
+            if not closed:
+                while self.queue.get() is not None:
+                    pass
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def flush(self, conn, days):
+        start = time.perf_counter()
+        with conn:
+            conn.executemany(
+                INSERT_HEADLINE_SQL,
+                [(headline, date) for headlines, date, _ in days for headline in headlines],
+            )
+            conn.executemany(
+                UPSERT_CRAWL_STATE_SQL,
+                [crawl_state_row(headlines, date, pages) for headlines, date, pages in days],
+            )
+        elapsed = time.perf_counter() - start
+        rows = sum(len(headlines) for headlines, _, _ in days)
+        WRITE_SECONDS.observe(elapsed)
+        ROWS_WRITTEN.inc(rows)
+        self.write_seconds += elapsed
+        self.rows_written += rows
+        self.days_written += len(days)
+        self.transactions += 1
+
+    def report(self):
+        elapsed = time.perf_counter() - self.started_at if self.started_at else 0.0
+        write_rate = self.rows_written / self.write_seconds if self.write_seconds else 0.0
+        wall_rate = self.rows_written / elapsed if elapsed else 0.0
+        return (
+            f"Writer: {self.rows_written} rows, {self.days_written} days in "
+            f"{self.transactions} transactions; {write_rate:.0f} rows/sec in SQLite, "
+            f"{wall_rate:.0f} rows/sec overall"
         )
 
 
-def fetch_headlines(session, year, month, day):
-    url = f"https://www.wsj.com/news/archive/{year}/{month}/{day}?page="
+def fetch_page(session, url, pacer=None):
+    """GET one archive page, retrying errors with backoff; (status, text) for a 200 or 404, else None."""
+    delay = FETCH_BACKOFF
+    for attempt in range(FETCH_ATTEMPTS):
+        if attempt:
+            FETCH_RETRIES.inc()
+            time.sleep(delay)
+            delay = min(delay * 2, FETCH_MAX_BACKOFF)
+        if pacer is not None:
+            pacer.wait(url)
+        try:
+            with FETCH_SECONDS.time():
+                response = session.get(url)
+        except requests.RequestException as e:
+            print(f"{url}: {e}")
+            continue
+        NETWORK_PAGES.inc()
+        if response.status_code in (200, 404):
+            return response.status_code, response.text
+        print(f"{url}: HTTP {response.status_code}")
+        retry_after = response.headers.get("retry-after", "")
+        if retry_after.isdigit():
+            delay = min(max(delay, float(retry_after)), FETCH_MAX_BACKOFF)
+    return None
+
+
+def fetch_day(
+    session,
+    year,
+    month,
+    day,
+    pacer=None,
+    base_url=ARCHIVE_URL,
+    extract=None,
+    cache=None,
+    replay=False,
+):
+    """Fetch every archive page of one day; returns (headlines, pages_with_headlines).
+
+    Pages found in `cache` are not downloaded again. With `replay`, the network
+    is never used and None is returned when the day is not fully cached. None
+    is also returned when a page keeps failing, so the day isn't marked done.
+    """
+    extract = extract or get_extractor()
+    ydm = f"{year:04d}-{month:02d}-{day:02d}"
+    url = f"{base_url}/{year}/{month}/{day}?page="
     page_num = 1
     headlines = []
     while True:
-        response = session.get(url + str(page_num))
-        if response.status_code == 404:
+        cached = cache.get(ydm, page_num) if cache is not None else None
+        if cached is not None:
+            status, text = cached
+            CACHED_PAGES.inc()
+        elif replay:
+            return None
+        else:
+            page = fetch_page(session, url + str(page_num), pacer)
+            if page is None:
+                FAILED_DAYS.inc()
+                return None
+            status, text = page
+            if cache is not None:
+                cache.put(ydm, page_num, status, text)
+        if status == 404:
             break
-        soup = BeautifulSoup(response.text, "html.parser")
-        page_headlines = [
-            headline.get_text()
-            for headline in soup.find_all(
-                "span", {"class": lambda x: x and "WSJTheme--headlineText" in x}
-            )
-        ]
+        with PARSE_SECONDS.time():
+            page_headlines = extract(text)
         if not page_headlines:
             break
+        HEADLINES_FOUND.inc(len(page_headlines))
         headlines.extend(page_headlines)
         page_num += 1
-    return headlines
-
-
-def main():
-    headers = {
-        "authority": "www.wsj.com",
-        "accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7",
-        "accept-language": "pt-BR,pt;q=0.9,en-US;q=0.8,en;q=0.7",
-        "cache-control": "max-age=0",
-        "cookie": "",
-        "sec-ch-ua": '"Chromium";v="122", "Not(A:Brand";v="24", "Google Chrome";v="122"',
-        "sec-ch-ua-mobile": "?0",
-        "sec-ch-ua-platform": '"Windows"',
-        "sec-fetch-dest": "document",
-        "sec-fetch-mode": "navigate",
-        "sec-fetch-site": "none",
-        "sec-fetch-user": "?1",
-        "upgrade-insecure-requests": "1",
-        "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36",
-    }
-    session = requests.Session()
-    session.headers.update(headers)
-    create_table()
-    start_date = datetime(1998, 1, 1)
-    end_date = datetime(2023, 12, 31)
+    return headlines, page_num - 1
+
+
+def daterange(start_date, end_date):
     current_date = start_date
     while current_date <= end_date:
-        headlines = fetch_headlines(
-            session, current_date.year, current_date.month, current_date.day
-        )
-        insert_data(headlines, current_date.strftime("%Y-%m-%d"))
+        yield current_date
         current_date += timedelta(days=1)
 
 
+def crawl(session, dates, workers=CRAWL_WORKERS, **fetch_kwargs):
+    """Fetch days on a thread pool, yielding (date, fetch_day result) in date order.
+
+    `fetch_kwargs` are passed through to fetch_day().
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for date in dates:
+            future = executor.submit(
+                fetch_day, session, date.year, date.month, date.day, **fetch_kwargs
+            )
+            pending.append((date, future))
+            # Bounded look-ahead keeps memory flat over 25 years of days
+            if len(pending) >= workers * 2:
+                date, future = pending.popleft()
+                yield date, future.result()
+        while pending:
+            date, future = pending.popleft()
+            yield date, future.result()
+
+
+def main(args):
+    session = make_session(args.pool_size)
+    pacer = HostPacer(args.delay)
+    cache = None
+    if not args.no_cache or args.replay:
+        cache = PageCache(args.cache_dir, int(args.cache_max_mb * 1024**2))
+    create_table()
+    start, end = args.start, args.end or datetime(2023, 12, 31)
+    if args.incremental:
+        latest = latest_date()
+        if latest is not None:
+            start = latest + timedelta(days=1)
+        # Today's archive is still filling up; it's fetched complete on the next run
+        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        end = args.end or today - timedelta(days=1)
+        print(f"Incremental crawl from {start:%Y-%m-%d} to {end:%Y-%m-%d}")
+    dates = daterange(start, end)
+    if args.incremental:
+        # Days that failed on earlier runs are fetched again first
+        gaps = missing_dates()
+        if gaps:
+            print(f"Retrying {len(gaps)} earlier days missing from crawl_state, from {gaps[0]:%Y-%m-%d}")
+        dates = chain(gaps, dates)
+    if args.resume:
+        done = completed_dates()
+        dates = (date for date in dates if date.strftime("%Y-%m-%d") not in done)
+    results = crawl(
+        session,
+        dates,
+        max(1, args.workers),
+        pacer=pacer,
+        base_url=args.base_url,
+        extract=get_extractor(args.extractor),
+        cache=cache,
+        replay=args.replay,
+    )
+    writer = HeadlineWriter(
+        batch_rows=args.batch_rows, flush_interval=args.flush_seconds
+    ).start()
+    exporter = metrics.start_export(args.metrics, args.metrics_interval)
+    skipped = 0
+    try:
+        for date, result in results:
+            if result is None:
+                skipped += 1
+                continue
+            headlines, pages = result
+            print(date.strftime("%Y-%m-%d"))
+            writer.put(headlines, date.strftime("%Y-%m-%d"), pages)
+    finally:
+        writer.close()
+        if exporter is not None:
+            exporter.stop()
+    print(writer.report())
+    if cache is not None:
+        print(cache.report())
+        cache.close()
+    if skipped and args.replay:
+        print(f"Replay: {skipped} days were not fully cached and were skipped")
+    elif skipped:
+        print(f"{skipped} days kept failing and were not marked complete; run again with --resume to fetch them")
+
+
 if __name__ == "__main__":
-    main()
+    main(parser.parse_args())
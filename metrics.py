@@ -0,0 +1,257 @@
+"""In-process metrics shared by the scraper, the scorer and the analysis.
+
+Counters and histograms live in one registry and are created on first use:
+
+    FETCH_SECONDS = metrics.histogram("scrape_fetch_seconds", "HTTP fetch latency per page")
+    with FETCH_SECONDS.time():
+        response = session.get(url)
+
+Recording a value takes one lock and a bisect over the bucket bounds, so it is
+cheap enough for per-request and per-page paths. An Exporter thread writes
+snapshots of the registry to a file every few seconds: Prometheus text format
+when the path ends in `.prom` or `.txt` (for a node_exporter textfile
+collector), otherwise JSON.
+"""
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+EXPORT_SECONDS = 10.0
+# Upper bounds in seconds, from sub-millisecond SQLite writes to minute-long rate-limit sleeps
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help="", labels=None):
+        self.name = name
+        self.help = help
+        self.labels = labels or {}
+        self.lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def snapshot(self):
+        return {"value": self.value}
+
+    def merge(self, snapshot):
+        self.inc(snapshot["value"])
+
+    def reset(self):
+        with self.lock:
+            self.value = 0
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help="", labels=None, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels or {}
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile (max for the overflow bucket)."""
+        with self.lock:
+            counts, count, largest = list(self.counts), self.count, self.max
+        if not count:
+            return 0.0
+        rank = q * count
+        seen = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            seen += bucket_count
+            if seen >= rank:
+                return bound
+        return largest
+
+    def snapshot(self):
+        with self.lock:
+            snapshot = {
+                "count": self.count,
+                "sum": self.sum,
+                "max": self.max,
+                "buckets": dict(zip(map(str, self.buckets), self.counts)),
+                "overflow": self.counts[-1],
+            }
+        for q in (0.5, 0.9, 0.99):
+            snapshot[f"p{round(q * 100)}"] = self.quantile(q)
+        return snapshot
+
+    def merge(self, snapshot):
+        with self.lock:
+            for index, bucket_count in enumerate(snapshot["buckets"].values()):
+                self.counts[index] += bucket_count
+            self.counts[-1] += snapshot["overflow"]
+            self.count += snapshot["count"]
+            self.sum += snapshot["sum"]
+            self.max = max(self.max, snapshot["max"])
+
+    def reset(self):
+        with self.lock:
+            self.counts = [0] * (len(self.buckets) + 1)
+            self.count = 0
+            self.sum = 0.0
+            self.max = 0.0
+
+
+def label_text(labels, extra=None):
+    labels = {**labels, **(extra or {})}
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in sorted(labels.items())) + "}"
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self.started_at = time.time()
+
+    def get(self, cls, name, help="", labels=None, **kwargs):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self.lock:
+            metric = self.metrics.get(key)
+            if metric is None:
+                metric = self.metrics[key] = cls(name, help, labels, **kwargs)
+            return metric
+
+    def counter(self, name, help="", labels=None):
+        return self.get(Counter, name, help, labels)
+
+    def histogram(self, name, help="", labels=None, buckets=LATENCY_BUCKETS):
+        return self.get(Histogram, name, help, labels, buckets=buckets)
+
+    def snapshot(self):
+        """Every metric as {"name{labels}": {"name": ..., "type": ..., "help": ..., "labels": ..., values}}."""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return {
+            metric.name + label_text(metric.labels): {
+                "name": metric.name,
+                "type": metric.kind,
+                "help": metric.help,
+                "labels": metric.labels,
+                **metric.snapshot(),
+            }
+            for metric in metrics
+        }
+
+    def merge(self, snapshot):
+        """Add a snapshot taken in another process (e.g. a pool worker) to this registry."""
+        for entry in snapshot.values():
+            cls = Counter if entry["type"] == "counter" else Histogram
+            self.get(cls, entry["name"], entry["help"], entry["labels"]).merge(entry)
+
+    def reset(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        for metric in metrics:
+            metric.reset()
+
+    def prometheus_text(self):
+        lines = []
+        described = set()
+        with self.lock:
+            metrics = sorted(self.metrics.values(), key=lambda metric: metric.name)
+        for metric in metrics:
+            if metric.name not in described:
+                described.add(metric.name)
+                lines.append(f"# HELP {metric.name} {metric.help}")
+                lines.append(f"# TYPE {metric.name} {metric.kind}")
+            snapshot = metric.snapshot()
+            if metric.kind == "counter":
+                lines.append(f"{metric.name}{label_text(metric.labels)} {snapshot['value']}")
+                continue
+            cumulative = 0
+            for bound, bucket_count in snapshot["buckets"].items():
+                cumulative += bucket_count
+                lines.append(f"{metric.name}_bucket{label_text(metric.labels, {'le': bound})} {cumulative}")
+            lines.append(f"{metric.name}_bucket{label_text(metric.labels, {'le': '+Inf'})} {snapshot['count']}")
+            lines.append(f"{metric.name}_sum{label_text(metric.labels)} {snapshot['sum']}")
+            lines.append(f"{metric.name}_count{label_text(metric.labels)} {snapshot['count']}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Atomically replace `path` with the current metrics, as Prometheus text or JSON."""
+        if str(path).endswith((".prom", ".txt")):
+            text = self.prometheus_text()
+        else:
+            text = json.dumps(
+                {
+                    "started_at": self.started_at,
+                    "written_at": time.time(),
+                    "metrics": self.snapshot(),
+                },
+                indent=2,
+            )
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            f.write(text)
+        os.replace(tmp, path)
+
+
+REGISTRY = Registry()
+
+
+def counter(name, help="", labels=None):
+    return REGISTRY.counter(name, help, labels)
+
+
+def histogram(name, help="", labels=None, buckets=LATENCY_BUCKETS):
+    return REGISTRY.histogram(name, help, labels, buckets)
+
+
+class Exporter:
+    """Writes the registry to `path` every `interval` seconds on a daemon thread, and once more on stop()."""
+
+    def __init__(self, path, interval=EXPORT_SECONDS, registry=REGISTRY):
+        self.path = path
+        self.interval = interval
+        self.registry = registry
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="metrics-exporter", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.registry.write(self.path)
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.registry.write(self.path)
+
+
+def start_export(path, interval=EXPORT_SECONDS):
+    """Start an Exporter for `path`, or return None when metrics export is off."""
+    return Exporter(path, interval).start() if path else None
@@ -0,0 +1,185 @@
+"""On-disk cache of raw archive responses.
+
+Pages are stored gzip-compressed under the SHA-256 of their body, so identical
+pages share one blob, and an SQLite index maps (ydm, page) to the response
+status and blob digest. 404s are indexed without a blob, which lets a replay
+know where each day's pages end. Least recently used blobs are evicted once
+the cache grows past `max_bytes`.
+"""
+import gzip
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+CACHE_DIR = "page_cache"
+CACHE_MAX_BYTES = 2 * 1024**3
+CACHEABLE_STATUSES = (200, 404)  # Anything else is transient and refetched
+TOUCH_BATCH = 1000  # Blobs read before their last_used times are written to the index
+
+
+class PageCache:
+    def __init__(self, root=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.root = Path(root)
+        self.blob_dir = self.root / "blobs"
+        self.blob_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self.evicted = 0
+        self.touched = {}  # digest -> when its blob was last read, not yet in the blobs table
+        self.conn = sqlite3.connect(self.root / "index.db", check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS pages (
+                ydm DATE,
+                page INTEGER,
+                status INTEGER,
+                digest TEXT,
+                PRIMARY KEY (ydm, page)
+            );
+            CREATE TABLE IF NOT EXISTS blobs (
+                digest TEXT PRIMARY KEY,
+                size INTEGER,
+                last_used REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_pages_digest ON pages (digest);
+            CREATE INDEX IF NOT EXISTS idx_blobs_last_used ON blobs (last_used);
+        """
+        )
+        self.total_bytes = self.conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM blobs"
+        ).fetchone()[0]
+
+    def blob_path(self, digest):
+        return self.blob_dir / digest[:2] / f"{digest}.gz"
+
+    def get(self, ydm, page):
+        """Return (status, text) for a cached response, or None on a miss.
+
+        Only the index lookup holds the lock; the blob is read and decompressed
+        outside it, and last_used updates are committed TOUCH_BATCH at a time.
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT status, digest FROM pages WHERE ydm = ? AND page = ?",
+                (ydm, page),
+            ).fetchone()
+        if row is None:
+            with self.lock:
+                self.misses += 1
+            return None
+        status, digest = row
+        if digest is None:
+            with self.lock:
+                self.hits += 1
+            return status, ""
+        try:
+            body = gzip.decompress(self.blob_path(digest).read_bytes())
+        except FileNotFoundError:  # Blob removed behind the index's back, or just evicted
+            with self.lock:
+                self.conn.execute(
+                    "DELETE FROM pages WHERE ydm = ? AND page = ? AND digest = ?", (ydm, page, digest)
+                )
+                self.conn.commit()
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+            self.touched[digest] = time.time()
+            if len(self.touched) >= TOUCH_BATCH:
+                self._write_blob_hits()
+                self.conn.commit()
+        return status, body.decode("utf-8")
+
+    def _write_blob_hits(self):
+        self.conn.executemany(
+            "UPDATE blobs SET last_used = ? WHERE digest = ?",
+            [(last_used, digest) for digest, last_used in self.touched.items()],
+        )
+        self.touched = {}
+
+    def put(self, ydm, page, status, text):
+        if status not in CACHEABLE_STATUSES:
+            return
+        digest = None
+        data = None
+        if status == 200:
+            body = text.encode("utf-8")
+            digest = hashlib.sha256(body).hexdigest()
+            path = self.blob_path(digest)
+            if not path.exists():
+                # Compressed and written outside the lock; a digest's blob always has the same bytes
+                path.parent.mkdir(exist_ok=True)
+                data = gzip.compress(body)
+                tmp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+                tmp_path.write_bytes(data)
+                os.replace(tmp_path, path)
+        with self.lock:
+            if data is not None:
+                cursor = self.conn.execute(
+                    "INSERT OR IGNORE INTO blobs (digest, size, last_used) VALUES (?, ?, ?)",
+                    (digest, len(data), time.time()),
+                )
+                if cursor.rowcount:  # Another thread may have stored the same page meanwhile
+                    self.total_bytes += len(data)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO pages (ydm, page, status, digest) VALUES (?, ?, ?, ?)",
+                (ydm, page, status, digest),
+            )
+            self._write_blob_hits()
+            self.conn.commit()
+            self.stored += 1
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Drop down to 90% of the budget so we don't evict on every put
+        target = self.max_bytes * 0.9
+        rows = self.conn.execute(
+            "SELECT digest, size FROM blobs ORDER BY last_used ASC"
+        ).fetchall()
+        for digest, size in rows:
+            if self.total_bytes <= target:
+                break
+            self.blob_path(digest).unlink(missing_ok=True)
+            self.conn.execute("DELETE FROM pages WHERE digest = ?", (digest,))
+            self.conn.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+            self.total_bytes -= size
+            self.evicted += 1
+        self.conn.commit()
+
+    def iter_texts(self):
+        """Yield the body of every cached 200 page, e.g. for extractor benchmarks."""
+        with self.lock:
+            digests = [
+                row[0]
+                for row in self.conn.execute(
+                    "SELECT DISTINCT digest FROM pages WHERE status = 200 AND digest IS NOT NULL"
+                )
+            ]
+        for digest in digests:
+            path = self.blob_path(digest)
+            if path.exists():
+                yield gzip.decompress(path.read_bytes()).decode("utf-8")
+
+    def report(self):
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups * 100 if lookups else 0.0
+        return (
+            f"Page cache: {self.hits} hits, {self.misses} misses ({hit_rate:.1f}% hit rate), "
+            f"{self.stored} stored, {self.evicted} evicted, "
+            f"{self.total_bytes / 1024**2:.1f} MB on disk"
+        )
+
+    def close(self):
+        with self.lock:
+            self._write_blob_hits()
+            self.conn.commit()
+            self.conn.close()
@@ -0,0 +1,104 @@
+"""Token-bucket admission control for the OpenAI chat completions API.
+
+A RateLimiter holds one bucket for requests per minute and one for tokens per
+minute. Workers call acquire() with the tokens a request will use before
+sending it; the buckets refill continuously and are re-synced with the limits
+the API reports in its `x-ratelimit-*` response headers.
+"""
+import threading
+import time
+
+
+class TokenBucket:
+    """Holds up to `capacity` units and refills `capacity` units every `period` seconds."""
+
+    def __init__(self, capacity, period=60.0):
+        self.max_capacity = capacity
+        self.capacity = capacity
+        self.period = period
+        self.level = float(capacity)
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        elapsed = now - self.updated
+        self.level = min(self.capacity, self.level + elapsed * self.capacity / self.period)
+        self.updated = now
+
+    def wait_time(self, amount):
+        amount = min(amount, self.capacity)  # Oversized requests wait for a full bucket
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) * self.period / self.capacity
+
+    def take(self, amount):
+        self.level -= min(amount, self.capacity)
+
+    def sync(self, limit=None, remaining=None):
+        """Adopt server-reported limits, never above the configured capacity."""
+        if limit:
+            self.capacity = min(limit, self.max_capacity)
+            self.level = min(self.level, self.capacity)
+        if remaining is not None:
+            # The server's count lags our in-flight requests, so only lower the level
+            self.level = min(self.level, remaining)
+
+
+class RateLimiter:
+    """Admits requests against requests-per-minute and tokens-per-minute buckets.
+
+    Safe to share between threads. acquire() blocks until both buckets have
+    room, and pause() holds every caller back after the API reports a rate
+    limit error.
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.lock = threading.Lock()
+        self.paused_until = 0.0
+        self.waited_seconds = 0.0
+
+    def acquire(self, tokens=0):
+        """Block until a request of `tokens` tokens may be sent; returns seconds waited."""
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.requests.refill(now)
+                self.tokens.refill(now)
+                wait = max(
+                    self.paused_until - now,
+                    self.requests.wait_time(1),
+                    self.tokens.wait_time(tokens),
+                )
+                if wait <= 0:
+                    self.requests.take(1)
+                    self.tokens.take(tokens)
+                    self.waited_seconds += waited
+                    return waited
+            time.sleep(wait)
+            waited += wait
+
+    def settle(self, estimated_tokens, used_tokens):
+        """Return unused tokens, or charge extra ones, once the real usage is known."""
+        with self.lock:
+            self.tokens.level = min(
+                self.tokens.capacity, self.tokens.level + estimated_tokens - used_tokens
+            )
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def update(self, limits):
+        """Sync with parsed `x-ratelimit-*` headers.
+
+        `limits` may hold limit_requests, remaining_requests, limit_tokens and
+        remaining_tokens; missing keys leave the bucket unchanged.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            self.requests.sync(limits.get("limit_requests"), limits.get("remaining_requests"))
+            self.tokens.sync(limits.get("limit_tokens"), limits.get("remaining_tokens"))
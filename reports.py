@@ -0,0 +1,108 @@
+"""Headless figure rendering and in-memory PDF assembly for the correlation reports.
+
+Figures are described as (renderer name, keyword arguments, figsize) jobs. Jobs are drawn
+on bare Agg `Figure` objects with no pyplot state, so they can be rendered in
+worker processes. Each job becomes PNG bytes, which are written out as image
+files and handed straight to the PDF writer, never read back from disk.
+Scatter plots with more than `hexbin_threshold` points are drawn as hexbin
+densities, which cost the same at any number of points.
+"""
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+import matplotlib
+
+matplotlib.use("Agg")
+
+from fpdf import FPDF  # noqa: E402
+from matplotlib.figure import Figure  # noqa: E402
+import numpy as np  # noqa: E402
+
+HEXBIN_THRESHOLD = 20000  # Points above which scatter plots become hexbin densities; 0 disables
+FIGURE_DPI = 100
+PDF_IMAGE_WIDTH = 180  # mm, on an A4 page with 10 mm margins
+
+
+def render_scatter(figure, x, y, xlabel, ylabel, title, fit=None, stats_text=None, hexbin_threshold=HEXBIN_THRESHOLD):
+    """Scatter of y against x with an optional fit line (slope, intercept) and stats box."""
+    ax = figure.subplots()
+    if hexbin_threshold and len(x) > hexbin_threshold:
+        cells = ax.hexbin(x, y, gridsize=120, bins="log", mincnt=1, cmap="viridis")
+        figure.colorbar(cells, ax=ax, label="Days (log scale)")
+    else:
+        ax.scatter(x, y, color="blue", label="Data Points")
+    if fit is not None:
+        m, c = fit
+        # A straight line only needs its endpoints, however many points there are
+        ends = np.array([np.min(x), np.max(x)])
+        ax.plot(ends, m * ends + c, "r-", label=f"Fit Line: y={m:.2f}x+{c:.2f}")
+    if stats_text:
+        ax.text(0.05, 0.95, stats_text, transform=ax.transAxes, fontsize=9, verticalalignment="top",
+                bbox=dict(boxstyle="round", facecolor="wheat", alpha=0.5))
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    ax.set_title(title)
+    # loc="best" searches every point for a free corner; the stats box already holds the upper left
+    ax.legend(loc="upper right")
+
+
+def render_heatmap(figure, values, columns, index, xlabel, ylabel, title, colorbar_label):
+    """Heatmap of a 2-D array, centred on zero, with integer column and row labels."""
+    ax = figure.subplots()
+    values = np.asarray(values, dtype=float)
+    limit = np.nanmax(np.abs(values)) if np.isfinite(values).any() else 1.0
+    image = ax.imshow(values, aspect="auto", origin="lower", cmap="RdBu_r", vmin=-limit, vmax=limit,
+                      extent=(min(columns) - 0.5, max(columns) + 0.5, 0, len(index)))
+    ax.set_yticks(np.arange(len(index)) + 0.5, [str(label) for label in index])
+    figure.colorbar(image, ax=ax, label=colorbar_label)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    ax.set_title(title)
+
+
+RENDERERS = {
+    "scatter": render_scatter,
+    "heatmap": render_heatmap,
+}
+
+
+def render_figure(job):
+    """Render one (renderer, kwargs, figsize) job to PNG bytes."""
+    renderer, kwargs, figsize = job
+    figure = Figure(figsize=figsize, dpi=FIGURE_DPI, layout="tight")
+    RENDERERS[renderer](figure, **kwargs)
+    buffer = BytesIO()
+    figure.savefig(buffer, format="png")
+    return buffer.getvalue()
+
+
+def render_figures(jobs, workers=None):
+    """Render jobs to PNG bytes, in parallel worker processes unless workers is 1 or there's one job."""
+    if workers == 1 or len(jobs) < 2:
+        return [render_figure(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=min(len(jobs), workers or os.cpu_count())) as pool:
+        return list(pool.map(render_figure, jobs))
+
+
+def png_size(png):
+    """(width, height) in pixels, from the PNG's IHDR chunk."""
+    return struct.unpack(">II", png[16:24])
+
+
+def build_pdf(path, pages):
+    """Write a PDF with one page per (title, png bytes, text lines) tuple, embedding images from memory."""
+    pdf = FPDF()
+    for title, png, lines in pages:
+        pdf.add_page()
+        pdf.set_font("helvetica", size=12)
+        pdf.cell(200, 10, text=title, new_x="LMARGIN", new_y="NEXT", align="C")
+        width, height = png_size(png)
+        pdf.image(BytesIO(png), x=10, y=20, w=PDF_IMAGE_WIDTH)
+        if lines:
+            pdf.set_y(20 + PDF_IMAGE_WIDTH * height / width + 5)
+            pdf.set_font("helvetica", size=10)
+            for line in lines:
+                pdf.cell(200, 8, text=line, new_x="LMARGIN", new_y="NEXT")
+    pdf.output(path)
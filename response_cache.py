@@ -0,0 +1,116 @@
+"""Persistent cache of validated completions, keyed by model and prompt.
+
+The key is a SHA-256 of the model name and the rendered messages, so re-runs
+after a crash, or after switching GPT_MODEL back, don't pay for prompts that
+were already answered. Only outputs that passed validation are stored, so a
+cached answer never sends the caller into a retry loop. Least recently used
+entries are evicted past `max_entries`.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+RESPONSE_CACHE_DB = "responses.db"
+RESPONSE_CACHE_MAX_ENTRIES = 5_000_000
+SERVED_BATCH = 1000  # Completions served before their last_used times are written back
+
+
+def cache_key(model, messages):
+    payload = json.dumps(
+        {"model": model, "messages": messages}, sort_keys=True, separators=(",", ":")
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, path=RESPONSE_CACHE_DB, max_entries=RESPONSE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self.evicted = 0
+        self.served = {}  # key -> when it was last served, not yet in the completions table
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS completions (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                output TEXT,
+                created_at REAL,
+                last_used REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_completions_last_used ON completions (last_used);
+        """
+        )
+        self.entries = self.conn.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+
+    def get(self, model, messages):
+        """Return the cached output text for this prompt, or None; last_used is written SERVED_BATCH hits at a time."""
+        key = cache_key(model, messages)
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT output FROM completions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.served[key] = time.time()
+            if len(self.served) >= SERVED_BATCH:
+                self._write_hit_times()
+                self.conn.commit()
+            return row[0]
+
+    def _write_hit_times(self):
+        self.conn.executemany(
+            "UPDATE completions SET last_used = ? WHERE key = ?",
+            [(last_used, key) for key, last_used in self.served.items()],
+        )
+        self.served = {}
+
+    def put(self, model, messages, output_text):
+        key = cache_key(model, messages)
+        now = time.time()
+        with self.lock:
+            cursor = self.conn.execute(
+                "INSERT OR IGNORE INTO completions (key, model, output, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, model, output_text, now, now),
+            )
+            self._write_hit_times()
+            self.conn.commit()
+            if cursor.rowcount:
+                self.entries += 1
+                self.stored += 1
+            if self.entries > self.max_entries:
+                self._evict()
+
+    def _evict(self):
+        # Trim to 90% of the budget so eviction doesn't run on every put
+        excess = self.entries - int(self.max_entries * 0.9)
+        self.conn.execute(
+            "DELETE FROM completions WHERE key IN (SELECT key FROM completions ORDER BY last_used ASC LIMIT ?)",
+            (excess,),
+        )
+        self.conn.commit()
+        self.entries -= excess
+        self.evicted += excess
+
+    def report(self):
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups * 100 if lookups else 0.0
+        return (
+            f"Response cache: {self.hits} hits, {self.misses} misses ({hit_rate:.1f}% hit rate), "
+            f"{self.stored} stored, {self.evicted} evicted, {self.entries} entries"
+        )
+
+    def close(self):
+        with self.lock:
+            self._write_hit_times()
+            self.conn.commit()
+            self.conn.close()
@@ -0,0 +1,423 @@
+"""Sharded scoring over partitioned copies of the headlines database.
+
+    python shards.py partition --shards 8 --by month
+    python shards.py score --key-env OPENAI_API_KEY --key-env OPENAI_API_KEY_2
+    python shards.py merge
+
+`partition` copies the unscored rows of the master database, ids included,
+into `shards/shard-NN.db` files, either as contiguous month ranges of similar
+size (`--by month`, which keeps every month's batches and repeats together)
+or by `id % shards` (`--by hash`), and writes a manifest.
+
+`score` runs one worker process per API key. A worker claims shards one at a
+time through an O_EXCL claim file next to the shard, so workers started on
+several machines sharing the directory never score the same shard at once.
+Each worker scores with its own Scorer, key and rate limiter. A claim left
+by a crashed worker is broken when its pid is gone on the same host, or
+after `--claim-timeout` seconds for other hosts.
+
+`merge` attaches each shard to the master and copies a score only where the
+master row with the same id and headline is still unscored. Nothing is ever
+overwritten, so it can be re-run at any time, even while shards are still
+being scored.
+"""
+import argparse
+import json
+import os
+import socket
+import sqlite3
+import time
+from dataclasses import replace
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import metrics
+from chatgpt import (
+    DB,
+    GPT_ENDPOINT,
+    GPT_REQUESTS_PER_MINUTE,
+    GPT_TOKENS_PER_MINUTE,
+    Scorer,
+    ScorerConfig,
+    db_status,
+)
+from response_cache import ResponseCache
+
+SHARD_DIR = "shards"
+SHARD_COUNT = 8
+MANIFEST = "manifest.json"
+KEY_ENV = "OPENAI_API_KEY"
+CLAIM_TIMEOUT = 24 * 3600  # Seconds after which a claim from another host is treated as abandoned
+
+# OpenProcess/GetExitCodeProcess values for the Windows liveness check
+PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+ERROR_ACCESS_DENIED = 5
+STILL_ACTIVE = 259
+
+MERGE_SQL = """
+    UPDATE headlines SET output = scored.output
+    FROM shard.headlines AS scored
+    WHERE headlines.id = scored.id
+      AND headlines.headline IS scored.headline
+      AND headlines.output IS NULL
+      AND scored.output IS NOT NULL
+"""
+
+
+def month_ranges(months, shards):
+    """Split ordered (month, rows) pairs into at most `shards` contiguous (first, last) runs of similar size."""
+    total = sum(count for _, count in months)
+    ranges = []
+    first = None
+    seen = 0
+    for month, count in months:
+        if first is None:
+            first = month
+        seen += count
+        if seen >= total * (len(ranges) + 1) / shards:
+            ranges.append((first, month))
+            first = None
+    return ranges
+
+
+def shard_units(conn, shards, by):
+    """(where, params) selecting each shard's rows of the headlines table."""
+    if by == "hash":
+        return [("id % ? = ?", [shards, number]) for number in range(shards)]
+    months = conn.execute(
+        "SELECT strftime('%Y-%m', ydm), COUNT(*) FROM headlines WHERE output IS NULL GROUP BY 1 ORDER BY 1"
+    ).fetchall()
+    undated = sum(count for month, count in months if month is None)
+    units = [
+        ("strftime('%Y-%m', ydm) BETWEEN ? AND ?", [first, last])
+        for first, last in month_ranges([row for row in months if row[0] is not None], shards)
+    ]
+    if undated:
+        # No month range selects them, so they go to the first shard
+        print(f"{undated} unscored rows have no valid ydm; they are put in the first shard")
+        where, params = units[0] if units else ("0", [])
+        units[:1] = [(f"{where} OR strftime('%Y-%m', ydm) IS NULL", params)]
+    return units
+
+
+def copy_rows(db, path, schema, where, params):
+    """Create the shard at `path` with the master's schema and copy its unscored rows; returns the row count."""
+    conn = sqlite3.connect(path)
+    try:
+        for sql in schema:
+            conn.execute(sql)
+        conn.execute("ATTACH DATABASE ? AS master", (str(db),))
+        with conn:
+            rows = conn.execute(
+                f"INSERT INTO headlines SELECT * FROM master.headlines WHERE output IS NULL AND ({where})",
+                params,
+            ).rowcount
+        conn.execute("DETACH DATABASE master")
+    finally:
+        conn.close()
+    return rows
+
+
+def partition(db=DB, shard_dir=SHARD_DIR, shards=SHARD_COUNT, by="month"):
+    """Copy the unscored rows of `db` into shard databases and write the manifest."""
+    shard_dir = Path(shard_dir)
+    if (shard_dir / MANIFEST).exists():
+        raise FileExistsError(
+            f"{shard_dir / MANIFEST} already exists; merge it and remove {shard_dir} before partitioning again"
+        )
+    shard_dir.mkdir(parents=True, exist_ok=True)
+    # The manifest is written last, so shard files without one are left over from
+    # an interrupted partition and have never been scored
+    for leftover in sorted(shard_dir.glob("shard-*.db*")):
+        print(f"Removing {leftover} from an interrupted partition")
+        leftover.unlink()
+    with sqlite3.connect(db) as conn:
+        # Indexes come along (the fan-out write of --dedup needs the (headline, ydm) one); triggers don't
+        schema = [
+            sql
+            for (sql,) in conn.execute(
+                "SELECT sql FROM sqlite_master WHERE tbl_name = 'headlines' AND type IN ('table', 'index') "
+                "AND sql IS NOT NULL ORDER BY type = 'index'"
+            )
+        ]
+        units = shard_units(conn, shards, by)
+    entries = []
+    for number, (where, params) in enumerate(units):
+        path = shard_dir / f"shard-{number:02d}.db"
+        rows = copy_rows(db, path, schema, where, params)
+        entries.append({"path": path.name, "where": where, "params": params, "rows": rows})
+        print(f"{path}: {rows} rows")
+    manifest = {
+        "db": str(Path(db).resolve()),
+        "by": by,
+        "created_at": time.time(),
+        "shards": entries,
+    }
+    (shard_dir / MANIFEST).write_text(json.dumps(manifest, indent=2))
+    return manifest
+
+
+def read_manifest(shard_dir=SHARD_DIR):
+    return json.loads((Path(shard_dir) / MANIFEST).read_text())
+
+
+def pid_alive(pid):
+    if os.name == "nt":
+        return windows_pid_alive(pid)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def windows_pid_alive(pid):
+    # os.kill(pid, 0) would terminate the process on Windows, so ask for its exit code instead
+    import ctypes
+
+    kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+    handle = kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+    if not handle:
+        return ctypes.get_last_error() == ERROR_ACCESS_DENIED
+    try:
+        code = ctypes.c_ulong()
+        if not kernel32.GetExitCodeProcess(handle, ctypes.byref(code)):
+            return True
+        return code.value == STILL_ACTIVE
+    finally:
+        kernel32.CloseHandle(handle)
+
+
+def claim_is_stale(text, timeout=CLAIM_TIMEOUT):
+    """Whether a claim file's `host pid time` belongs to a dead process here, or is older than `timeout`."""
+    try:
+        host, pid, claimed_at = text.split()
+        pid, claimed_at = int(pid), float(claimed_at)
+    except ValueError:
+        return False  # Still being written
+    if host == socket.gethostname() and not pid_alive(pid):
+        return True
+    return time.time() - claimed_at > timeout
+
+
+def break_stale_claim(path, timeout=CLAIM_TIMEOUT):
+    """Remove the claim on `path` if it is stale; True when it was removed."""
+    claim_path = f"{path}.claim"
+    try:
+        text = Path(claim_path).read_text()
+    except FileNotFoundError:
+        return True
+    if not claim_is_stale(text, timeout):
+        return False
+    # Move it aside first, so two workers breaking the same claim can't remove a fresh one
+    aside = f"{claim_path}.{socket.gethostname()}.{os.getpid()}"
+    try:
+        os.rename(claim_path, aside)
+    except FileNotFoundError:
+        return False
+    broken = Path(aside).read_text() == text
+    if not broken:
+        try:
+            os.link(aside, claim_path)  # Someone re-claimed in between; put their claim back
+        except FileExistsError:
+            pass
+    os.remove(aside)
+    if broken:
+        print(f"{path}: broke stale claim ({text.strip()})")
+    return broken
+
+
+def claim(path, timeout=CLAIM_TIMEOUT):
+    """Take the shard at `path` for this process; False if another live worker holds it."""
+    for _ in range(2):
+        try:
+            fd = os.open(f"{path}.claim", os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            if not break_stale_claim(path, timeout):
+                return False
+    else:
+        return False
+    with os.fdopen(fd, "w") as f:
+        f.write(f"{socket.gethostname()} {os.getpid()} {time.time()}\n")
+    return True
+
+
+def release(path):
+    os.remove(f"{path}.claim")
+
+
+def score_shards(
+    shard_dir, config, workers, batch_size, distinct, response_cache=None, claim_timeout=CLAIM_TIMEOUT
+):
+    """Score every unclaimed shard that still has unscored rows, one at a time; returns their names."""
+    shard_dir = Path(shard_dir)
+    scored = []
+    for entry in read_manifest(shard_dir)["shards"]:
+        path = shard_dir / entry["path"]
+        if not claim(path, claim_timeout):
+            continue
+        try:
+            if db_status(path)["unscored"]:
+                Scorer(replace(config, db=str(path)), response_cache).score(workers, batch_size, distinct)
+                print(f"\n{path}: {db_status(path)['unscored']} rows left unscored")
+                scored.append(entry["path"])
+        finally:
+            release(path)
+    return scored
+
+
+def score_with_key(shard_dir, key_env, options):
+    """score_shards() in a pool worker with the API key from `key_env`; returns (shards, metrics snapshot)."""
+    metrics.REGISTRY.reset()
+    config = ScorerConfig(
+        api_key=os.environ[key_env],
+        endpoint=options["endpoint"],
+        requests_per_minute=options["requests_per_minute"],
+        tokens_per_minute=options["tokens_per_minute"],
+    )
+    response_cache = None
+    if options["response_cache"]:
+        response_cache = ResponseCache(options["response_cache"])
+    try:
+        scored = score_shards(
+            shard_dir,
+            config,
+            options["workers"],
+            options["batch_size"],
+            options["dedup"],
+            response_cache,
+            options["claim_timeout"],
+        )
+    finally:
+        if response_cache is not None:
+            response_cache.close()
+    return scored, metrics.REGISTRY.snapshot()
+
+
+def run_keys(shard_dir, key_envs, options):
+    """One worker process per API key, each working through the shards."""
+    with ProcessPoolExecutor(max_workers=len(key_envs)) as pool:
+        futures = {pool.submit(score_with_key, shard_dir, name, options): name for name in key_envs}
+        for future in as_completed(futures):
+            scored, snapshot = future.result()
+            metrics.REGISTRY.merge(snapshot)
+            print(f"{futures[future]}: scored {', '.join(scored) or 'no shards'}")
+
+
+def merge(shard_dir=SHARD_DIR, db=None):
+    """Copy shard scores into still-unscored master rows; returns {shard: rows merged}."""
+    shard_dir = Path(shard_dir)
+    manifest = read_manifest(shard_dir)
+    conn = sqlite3.connect(db or manifest["db"])
+    conn.execute("PRAGMA busy_timeout=30000")
+    merged = {}
+    try:
+        for entry in manifest["shards"]:
+            conn.execute("ATTACH DATABASE ? AS shard", (str(shard_dir / entry["path"]),))
+            try:
+                with conn:
+                    merged[entry["path"]] = conn.execute(MERGE_SQL).rowcount
+            finally:
+                conn.execute("DETACH DATABASE shard")
+    finally:
+        conn.close()
+    return merged
+
+
+def shard_status(shard_dir=SHARD_DIR):
+    shard_dir = Path(shard_dir)
+    for entry in read_manifest(shard_dir)["shards"]:
+        path = shard_dir / entry["path"]
+        status = db_status(path)
+        try:
+            claim_text = Path(f"{path}.claim").read_text()
+        except FileNotFoundError:
+            claim_text = None
+        note = ""
+        if claim_text is not None:
+            note = " (stale claim)" if claim_is_stale(claim_text) else " (claimed)"
+        print(f"{entry['path']}: {status['scored']}/{status['headlines']} scored{note}")
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--shard-dir", default=SHARD_DIR, help="Directory of the shard databases and manifest")
+commands = parser.add_subparsers(dest="command", required=True)
+partition_parser = commands.add_parser("partition", help="Copy unscored rows into shard databases")
+partition_parser.add_argument("--db", default=DB, help="Master headlines database")
+partition_parser.add_argument("-n", "--shards", type=int, default=SHARD_COUNT)
+partition_parser.add_argument(
+    "--by", choices=("month", "hash"), default="month", help="Contiguous month ranges or id %% shards"
+)
+score_parser = commands.add_parser("score", help="Score unclaimed shards, one worker process per API key")
+score_parser.add_argument(
+    "--key-env",
+    action="append",
+    help=f"Environment variable holding an API key; repeat for more keys (default: {KEY_ENV})",
+)
+score_parser.add_argument("-w", "--workers", type=int, default=8, help="Requests in flight per key")
+score_parser.add_argument("-b", "--batch-size", type=int, default=1)
+score_parser.add_argument("--dedup", action="store_true")
+score_parser.add_argument("--endpoint", default=GPT_ENDPOINT)
+score_parser.add_argument("--requests-per-minute", type=int, default=GPT_REQUESTS_PER_MINUTE, help="Per key")
+score_parser.add_argument("--tokens-per-minute", type=int, default=GPT_TOKENS_PER_MINUTE, help="Per key")
+score_parser.add_argument(
+    "--response-cache", help="Response cache file, shared by the workers on this machine (default: none)"
+)
+score_parser.add_argument(
+    "--claim-timeout",
+    type=float,
+    default=CLAIM_TIMEOUT,
+    help="Seconds after which another host's claim is broken (claims of dead processes on this host always are)",
+)
+score_parser.add_argument(
+    "--metrics",
+    metavar="PATH",
+    help="Export timings and counters here (.prom/.txt: Prometheus text, else JSON)",
+)
+score_parser.add_argument("--metrics-interval", type=float, default=metrics.EXPORT_SECONDS)
+merge_parser = commands.add_parser("merge", help="Copy shard scores into the master database")
+merge_parser.add_argument("--db", help="Master headlines database (default: the one partitioned)")
+commands.add_parser("status", help="Scored rows and claims per shard")
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    if args.command == "partition":
+        try:
+            partition(args.db, args.shard_dir, args.shards, args.by)
+        except FileExistsError as e:
+            parser.error(str(e))
+    elif args.command == "score":
+        key_envs = args.key_env or [KEY_ENV]
+        missing = [name for name in key_envs if not os.environ.get(name)]
+        if missing:
+            parser.error(f"API key environment variables not set: {', '.join(missing)}")
+        exporter = metrics.start_export(args.metrics, args.metrics_interval)
+        try:
+            run_keys(
+                args.shard_dir,
+                key_envs,
+                {
+                    "workers": args.workers,
+                    "batch_size": args.batch_size,
+                    "dedup": args.dedup,
+                    "endpoint": args.endpoint,
+                    "requests_per_minute": args.requests_per_minute,
+                    "tokens_per_minute": args.tokens_per_minute,
+                    "response_cache": args.response_cache,
+                    "claim_timeout": args.claim_timeout,
+                },
+            )
+        finally:
+            if exporter is not None:
+                exporter.stop()
+    elif args.command == "merge":
+        merged = merge(args.shard_dir, args.db)
+        for path, rows in merged.items():
+            print(f"{path}: {rows} rows merged")
+        print(f"total: {sum(merged.values())} rows merged")
+    else:
+        shard_status(args.shard_dir)
@@ -0,0 +1,125 @@
+"""Work queue over the unscored rows of the headlines table.
+
+Rows with `output IS NULL` are read in (ydm, id) order with keyset pagination
+over a partial index that only holds unscored rows, so a restart starts at the
+first unscored row straight away instead of rescanning the table. Scores are
+buffered and committed in batches, every `commit_rows` rows or
+`commit_seconds` seconds, so at most one batch of work is lost in a crash.
+"""
+import sqlite3
+import time
+
+import metrics
+
+WORK_CHUNK_ROWS = 2000
+WORK_COMMIT_ROWS = 500
+WORK_COMMIT_SECONDS = 10.0
+
+WRITE_SECONDS = metrics.histogram("score_write_seconds", "SQLite transaction time per score commit")
+ROWS_WRITTEN = metrics.counter("score_rows_written_total", "Headline rows updated with a score")
+
+UPDATE_SQL = "UPDATE headlines SET output = ? WHERE id = ?"
+# Scores every still unscored copy of the row's headline within the same
+# month, found through the (headline, ydm) unique index
+FAN_OUT_SQL = """
+    UPDATE headlines SET output = ?1
+    WHERE headline = (SELECT headline FROM headlines WHERE id = ?2)
+      AND strftime('%Y-%m', ydm) = (SELECT strftime('%Y-%m', ydm) FROM headlines WHERE id = ?2)
+      AND output IS NULL
+"""
+
+
+class WorkQueue:
+    def __init__(
+        self,
+        db,
+        chunk_rows=WORK_CHUNK_ROWS,
+        commit_rows=WORK_COMMIT_ROWS,
+        commit_seconds=WORK_COMMIT_SECONDS,
+        distinct=False,
+        since=None,
+    ):
+        self.chunk_rows = chunk_rows
+        self.commit_rows = commit_rows
+        self.commit_seconds = commit_seconds
+        self.distinct = distinct
+        self.since = since
+        self.pending = []
+        self.last_commit = time.monotonic()
+        self.rows_claimed = 0
+        self.rows_written = 0
+        self.conn = sqlite3.connect(db)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA busy_timeout=30000")
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_headlines_unscored ON headlines (ydm, id) WHERE output IS NULL"
+        )
+        self.conn.commit()
+
+    def count(self):
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM headlines WHERE output IS NULL"
+        ).fetchone()[0]
+
+    def claim(self, after=None):
+        """Return the next chunk of unscored rows after the (ydm, id) key `after`."""
+        select = "SELECT id, strftime('%Y', ydm), strftime('%m', ydm), headline, ydm FROM headlines"
+        if after is None:
+            return self.conn.execute(
+                f"{select} WHERE output IS NULL ORDER BY ydm, id LIMIT ?",
+                (self.chunk_rows,),
+            ).fetchall()
+        return self.conn.execute(
+            f"{select} WHERE output IS NULL AND (ydm, id) > (?, ?) ORDER BY ydm, id LIMIT ?",
+            (*after, self.chunk_rows),
+        ).fetchall()
+
+    def rows(self):
+        """Yield (id, year, month, headline) for every unscored row, in date order.
+
+        With `distinct`, a headline already handed out this month is skipped;
+        its score reaches the copy through the fan-out write. With `since`
+        (YYYY-MM-DD), rows of earlier days are left alone.
+        """
+        # Every id is positive, so (since, 0) puts the first key at the start of that day
+        after = (self.since, 0) if self.since else None
+        month = None
+        seen = set()
+        while True:
+            chunk = self.claim(after)
+            if not chunk:
+                return
+            for id, year, row_month, headline, ydm in chunk:
+                if self.distinct:
+                    if (year, row_month) != month:
+                        month, seen = (year, row_month), set()
+                    if headline in seen:
+                        continue
+                    seen.add(headline)
+                self.rows_claimed += 1
+                yield id, year, row_month, headline
+            after = (chunk[-1][4], chunk[-1][0])
+
+    def write(self, id, output):
+        self.pending.append((output, id))
+        if (
+            len(self.pending) >= self.commit_rows
+            or time.monotonic() - self.last_commit >= self.commit_seconds
+        ):
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            with WRITE_SECONDS.time(), self.conn:
+                cursor = self.conn.executemany(
+                    FAN_OUT_SQL if self.distinct else UPDATE_SQL, self.pending
+                )
+            ROWS_WRITTEN.inc(cursor.rowcount)
+            self.rows_written += cursor.rowcount
+            self.pending = []
+        self.last_commit = time.monotonic()
+
+    def close(self):
+        self.flush()
+        self.conn.close()